@@ -1,20 +1,124 @@
+import time
+
+STARTED = time.perf_counter()  # before the heavy imports below, for the startup time report
+
+import argparse
+import collections
+import glob
+import os
 import sys
-from PyQt5.QtWidgets import QApplication, QMainWindow, QVBoxLayout, QHBoxLayout, QWidget, QPushButton, QLabel
-from PyQt5.QtCore import QTimer
-from PyQt5.QtMultimedia import QSound
-from PyQt5.QtCore import QUrl
-from PyQt5.QtMultimedia import QMediaContent, QMediaPlayer
+from PyQt5.QtWidgets import QApplication, QMainWindow, QVBoxLayout, QHBoxLayout, QWidget, QPushButton, QLabel, QSlider
+from PyQt5.QtCore import QTimer, Qt, QBuffer, QIODevice, QObject, pyqtSignal
 from datetime import datetime
 import pyqtgraph as pg
 import logging
-import csv
-import matplotlib.pyplot as plt
+from tank_engine import TankEngine
+from lod import MinMaxPyramid
+from recorder import RunRecorder
+from simulation_worker import SimulationWorker
+from integrators import INTEGRATORS
+from alarms import AlarmManager, NullSink
+from profiling import Profiler
+
+# Audio, the end-of-run export (matplotlib), the queued log writer, checkpoints, replay, telemetry and Modbus are
+# imported on first use, so they cost nothing at startup
+
+
+# Plays the alarm manager's preloaded PCM buffers. The alarm thread only emits signals; the QAudioOutputs
+# live on the GUI thread, where starting one from an in-memory buffer is cheap. QtMultimedia is loaded when
+# the first alarm sounds; if it cannot be loaded the alarms stay silent and a warning is logged.
+class QtAudioSink(QObject):
+    play_requested = pyqtSignal(str)
+    stop_requested = pyqtSignal()
+
+    def __init__(self, logger=None):
+        super().__init__()
+        self.logger = logger if logger is not None else logging.getLogger('TankSimulation')
+        self.sounds = []
+        self.outputs = None
+        self.current = None
+        self.play_requested.connect(self.on_play)
+        self.stop_requested.connect(self.on_stop)
+
+    def prepare(self, sound):
+        self.sounds.append(sound)
+
+    def create_outputs(self):
+        try:
+            from PyQt5.QtMultimedia import QAudioFormat, QAudioOutput
+        except ImportError as error:
+            self.logger.warning(f"Alarm audio unavailable: {error}")
+            self.outputs = {}
+            return
+        self.outputs = {}
+        for sound in self.sounds:
+            self.outputs[sound.name] = self.create_output(sound, QAudioFormat, QAudioOutput)
+
+    def create_output(self, sound, QAudioFormat, QAudioOutput):
+        audio_format = QAudioFormat()
+        audio_format.setCodec("audio/pcm")
+        audio_format.setSampleRate(sound.frame_rate)
+        audio_format.setChannelCount(sound.channels)
+        audio_format.setSampleSize(8 * sound.sample_width)
+        audio_format.setSampleType(QAudioFormat.SignedInt if sound.sample_width > 1 else QAudioFormat.UnSignedInt)
+        audio_format.setByteOrder(QAudioFormat.LittleEndian)
+        buffer = QBuffer(self)
+        buffer.setData(sound.frames)
+        buffer.open(QIODevice.ReadOnly)
+        return QAudioOutput(audio_format, self), buffer
+
+    def play(self, sound):
+        self.play_requested.emit(sound.name)
+
+    def stop(self):
+        self.stop_requested.emit()
+
+    def on_play(self, name):
+        if self.outputs is None:
+            self.create_outputs()
+        self.on_stop()
+        if name not in self.outputs:
+            return
+        output, buffer = self.outputs[name]
+        buffer.seek(0)
+        output.start(buffer)
+        self.current = output
 
+    def on_stop(self):
+        if self.current is not None:
+            self.current.stop()
+            self.current = None
 
 
 class TankSimulation(QMainWindow):
-    def __init__(self):
+    def __init__(self, history_window=3600, history_spill_path=None, record_format='csv', replay_path=None,
+                 replay_speed=1.0, time_step=0.1, speed=1.0, refresh_rate=30, integrator='euler',
+                 log_file='tank_simulation.log', log_max_bytes=10 * 1024 * 1024, log_flush_interval=1.0,
+                 profile=False, metrics_path=None, restore_path=None, checkpoint_path=None, checkpoint_interval=60.0,
+                 report=False, audio=True, telemetry_port=None, modbus_port=None, network_path=None):
         super().__init__()
+        self.log_file = log_file
+        self.log_max_bytes = log_max_bytes
+        self.log_flush_interval = log_flush_interval
+        self.profiler = Profiler() if profile or metrics_path else None
+        self.metrics_path = metrics_path
+        self.restore_path = restore_path
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_interval = checkpoint_interval
+        self.report = report
+        self.audio = audio
+        self.telemetry_port = telemetry_port
+        self.modbus_port = modbus_port
+        self.integrator = integrator
+        self.network_path = network_path
+        self.time_step = time_step
+        self.speed = speed
+        self.refresh_rate = refresh_rate
+        self.history_window = history_window
+        self.history_spill_path = history_spill_path
+        self.record_format = record_format
+        self.replay_path = replay_path
+        self.replay_speed = replay_speed
         self.setWindowTitle("Two-Tank System Simulation")
         self.setGeometry(100, 100, 1000, 800)
 
@@ -25,11 +129,23 @@ class TankSimulation(QMainWindow):
         self.plot_widget = pg.PlotWidget()
         main_layout.addWidget(self.plot_widget)
 
+        # Live tick timings, drawn over the plot when profiling is on
+        self.overlay = QLabel(self.plot_widget)
+        self.overlay.setStyleSheet("background-color: rgba(0, 0, 0, 160); color: white; font-family: monospace; padding: 4px;")
+        self.overlay.move(80, 10)
+        self.overlay.setVisible(self.profiler is not None)
+
+        self.seek_slider = QSlider(Qt.Horizontal)
+        self.seek_slider.setRange(0, 1000)
+        self.seek_slider.sliderReleased.connect(self.seek_replay)
+        self.seek_slider.setVisible(replay_path is not None)
+        main_layout.addWidget(self.seek_slider)
+
         button_layout = QHBoxLayout()
         main_layout.addLayout(button_layout)
 
         self.stop_button = QPushButton("Stop Simulation")
-        self.stop_button.clicked.connect(self.stop_simulation)
+        self.stop_button.clicked.connect(self.close)
         button_layout.addWidget(self.stop_button)
 
         self.power_loss_button = QPushButton("Simulate Power Loss")
@@ -56,62 +172,95 @@ class TankSimulation(QMainWindow):
         self.stop_drain_button.clicked.connect(self.stop_water_drain)
         button_layout.addWidget(self.stop_drain_button)
 
+        self.acknowledge_button = QPushButton("Acknowledge Alarms")
+        self.acknowledge_button.clicked.connect(self.acknowledge_alarms)
+        button_layout.addWidget(self.acknowledge_button)
+
         self.status_label = QLabel("System Status: Normal")
         main_layout.addWidget(self.status_label)
 
+        # Physics runs on the worker thread; this timer only refreshes the view
         self.timer = QTimer()
         self.timer.timeout.connect(self.update_simulation)
-        self.timer.start(100)  # Update every 100 ms
-
-        self.player_90 = QMediaPlayer()
-        self.player_95 = QMediaPlayer()
-        self.player_100 = QMediaPlayer()
+        self.timer.start(int(1000 / self.refresh_rate))
 
+        self.stopped = False
+        # Before the engine exists, so checkpoint restore, telemetry and Modbus startup messages reach the log
+        self.setup_logger()
         self.initialize_simulation()
+        if self.replay is not None:
+            for button in (self.power_loss_button, self.sensor_failure_button, self.start_flow_button,
+                           self.stop_flow_button, self.start_drain_button, self.stop_drain_button):
+                button.setEnabled(False)
         self.setup_plot()
         self.setup_sounds()
-        self.setup_logger()
-        logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO)
-        self.logger = logging.getLogger('TankSimulation')
+
+        if self.replay is None:
+            self.worker.start()
 
 
     def setup_logger(self):
+        # Logging calls only enqueue; a background writer formats JSON lines and writes them in batches
+        from event_log import setup_logging
         self.logger = logging.getLogger('TankSimulation')
-        self.logger.setLevel(logging.INFO)
-        handler = logging.FileHandler('tank_simulation.log')
-        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-        handler.setFormatter(formatter)
-        self.logger.addHandler(handler)
+        self.log_writer = setup_logging(self.logger, filename=self.log_file, max_bytes=self.log_max_bytes,
+                                        flush_interval=self.log_flush_interval)
 
     def initialize_simulation(self):
-        self.tank1_max = 100
-        self.tank2_max = 100
-        self.level1 = 0
-        self.level2 = 0
-        self.time = 0
-        self.times = []
-        self.levels1 = []
-        self.levels2 = []
-        self.power_on = True
-        self.sensor_working = True
-        self.water_flow = False
-        self.water_drain = False
-        self.setpoint1 = 50  # Desired level for tank 1
-        self.setpoint2 = 50  # Desired level for tank 2
-        self.Kp = 0.5  # Proportional gain
-        self.Ki = 0.1  # Integral gain
-        self.Kd = 0.05  # Derivative gain
-        self.integral1 = 0
-        self.integral2 = 0
-        self.prev_error1 = 0
-        self.prev_error2 = 0
-
-    def pid_control(self, level, setpoint, integral, prev_error):
-        error = setpoint - level
-        integral += error * 0.1  # Assuming 0.1 second time step
-        derivative = (error - prev_error) / 0.1
-        output = self.Kp * error + self.Ki * integral + self.Kd * derivative
-        return max(0, min(1, output)), integral, error
+        if self.network_path is not None:
+            # Tanks 1 and 2 are stepped together with the pipes, valves and pumps of the layout
+            from hydraulics import NetworkIntegrator, load_network
+            integrator = NetworkIntegrator(load_network(self.network_path, time_step=self.time_step))
+        else:
+            integrator = INTEGRATORS[self.integrator]()
+        self.engine = TankEngine(time_step=self.time_step, history_window=self.history_window,
+                                 history_spill_path=self.history_spill_path, integrator=integrator,
+                                 profiler=self.profiler)
+        if self.restore_path is not None:
+            # Continue a saved run instead of starting from empty tanks
+            from checkpoint import load_checkpoint
+            load_checkpoint(self.restore_path, engine=self.engine)
+        self.engine.subscribe(self.on_engine_update)
+        self.worker = SimulationWorker(self.engine, speed=self.speed)
+        self.plot_lod = MinMaxPyramid(self.engine.history)
+        self.plot_dirty = False
+        self.pending_status = collections.deque(maxlen=1)
+        self.last_frame = None
+        self.overlay_sample = (time.monotonic(), 0, 0)
+
+        self.telemetry = None
+        if self.telemetry_port is not None:
+            # Other displays and historians subscribe over localhost instead of opening their own windows
+            from telemetry import TelemetryServer
+            self.telemetry = TelemetryServer(port=self.telemetry_port, logger=self.engine.logger)
+            self.telemetry.attach(self.engine)
+            self.telemetry.start()
+
+        self.modbus = None
+        if self.modbus_port is not None:
+            # PLC logic under test scans the engine directly; writes are applied between steps under the worker lock
+            from modbus_server import ModbusServer
+            self.modbus = ModbusServer(port=self.modbus_port, logger=self.engine.logger)
+            self.modbus.attach(self.engine, self.worker.lock)
+            self.modbus.start()
+
+        self.replay = None
+        self.recorder = None
+        self.run_timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        if self.replay_path is not None:
+            from replay import RunReplay
+            self.replay = RunReplay(self.engine, self.replay_path, speed=self.replay_speed)
+            self.last_replay_tick = time.monotonic()
+            self.data_filename = self.replay_path
+            return
+
+        extension = '.csv' if self.record_format == 'csv' else ''
+        self.data_filename = f"simulation_data_{self.run_timestamp}{extension}"
+        self.recorder = RunRecorder(self.data_filename, format=self.record_format, time_step=self.engine.time_step)
+        self.recorder.attach(self.engine)
+        if self.checkpoint_path is not None:
+            from checkpoint import Checkpointer
+            Checkpointer(self.checkpoint_path, self.checkpoint_interval).attach(self.engine)
 
     def setup_plot(self):
         self.plot_widget.setBackground('w')
@@ -123,6 +272,7 @@ class TankSimulation(QMainWindow):
 
         self.curve1 = self.plot_widget.plot(pen=pg.mkPen('b', width=3), name='Tank 1')
         self.curve2 = self.plot_widget.plot(pen=pg.mkPen('r', width=3), name='Tank 2')
+        self.plot_widget.getViewBox().sigRangeChangedManually.connect(self.update_plot)
 
         self.plot_widget.addLine(y=30, pen=pg.mkPen('b', width=2, style=pg.QtCore.Qt.DashLine))
         self.plot_widget.addLine(y=20, pen=pg.mkPen('r', width=2, style=pg.QtCore.Qt.DashLine))
@@ -131,180 +281,235 @@ class TankSimulation(QMainWindow):
         self.plot_widget.addLine(y=95, pen=pg.mkPen('m', width=2, style=pg.QtCore.Qt.DashLine))
 
     def setup_sounds(self):
-        self.sound_90 = QSound("sound_90.wav")
-        self.sound_95 = QSound("sound_95.wav")
-        self.sound_100 = QSound("sound_100.wav")
-        self.player_90.setMedia(QMediaContent(QUrl.fromLocalFile("./sound_90.wav")))
-        self.player_95.setMedia(QMediaContent(QUrl.fromLocalFile("./sound_95.wav")))
-        self.player_100.setMedia(QMediaContent(QUrl.fromLocalFile("./sound_100.wav")))
+        # The WAVs are decoded once here; alarms are then driven by the engine's threshold events
+        sink = QtAudioSink(self.engine.logger) if self.audio else NullSink()
+        self.alarms = AlarmManager(sink, directory=os.path.dirname(os.path.abspath(__file__)),
+                                   logger=self.engine.logger)
+        self.alarms.attach(self.engine)
+        self.alarms.profiler = self.profiler
+        self.alarms.start()
 
     def update_simulation(self):
-        if not self.power_on:
-            self.status_label.setText("System Status: Power Off")
-            return
-
-        time_step = 0.1
-        self.time += time_step
-
-        if self.sensor_working:
-            if self.water_flow:
-                control1, self.integral1, self.prev_error1 = self.pid_control(self.level1, self.setpoint1, self.integral1, self.prev_error1)
-                control2, self.integral2, self.prev_error2 = self.pid_control(self.level2, self.setpoint2, self.integral2, self.prev_error2)
-                self.level1 = min(self.level1 + control1 * time_step, self.tank1_max)
-                self.level2 = min(self.level2 + control2 * time_step, self.tank2_max)
-            if self.water_drain:
-                drain_rate1 = self.calculate_control(self.level1, 30, 80, 90, 95, is_draining=True)
-                drain_rate2 = self.calculate_control(self.level2, 20, 80, 90, 95, is_draining=True)
-                self.level1 = max(self.level1 - 0.5 * time_step, 0)  # Constant drain rate
-                self.level2 = max(self.level2 - 0.5 * time_step, 0)
-        else:
-            self.status_label.setText("System Status: Sensor Failure")
-
-        self.check_overflow()
-        self.check_failsafe()
-        self.play_alarms()
-
-        self.times.append(self.time)
-        self.levels1.append(self.level1)
-        self.levels2.append(self.level2)
-
-        self.curve1.setData(self.times, self.levels1)
-        self.curve2.setData(self.times, self.levels2)
-
-        if self.level1 >= 30 and self.prev_level1 < 30:
-            self.logger.info("Tank 1 reached 30% level")
-        if self.level2 >= 20 and self.prev_level2 < 20:
-            self.logger.info("Tank 2 reached 20% level")
-    
-        if self.level1 >= 80 and self.prev_level1 < 80:
-            self.logger.info("Tank 1 reached 80% level")
-        if self.level2 >= 80 and self.prev_level2 < 80:
-            self.logger.info("Tank 2 reached 80% level")
-    
-        if self.level1 >= 90 and self.prev_level1 < 90:
-            self.logger.info("Tank 1 reached 90% level")
-        if self.level2 >= 90 and self.prev_level2 < 90:
-            self.logger.info("Tank 2 reached 90% level")
-    
-        if self.level1 >= 95 and self.prev_level1 < 95:
-            self.logger.info("Tank 1 reached 95% level")
-        if self.level2 >= 95 and self.prev_level2 < 95:
-            self.logger.info("Tank 2 reached 95% level")
-    
-        self.prev_level1 = self.level1
-        self.prev_level2 = self.level2
-
-    def calculate_control(self, level, start_fill, slow_down1, slow_down2, stop_fill, is_draining=False):
-        if is_draining:
-            return 0.5  # Constant drain rate
-        if level < start_fill:
-            return 1
-        elif start_fill <= level < slow_down1:
-            return 1
-        elif slow_down1 <= level < slow_down2:
-            return 0.5
-        elif slow_down2 <= level < stop_fill:
-            return 0.25
+        profiler = self.profiler
+        if profiler is not None:
+            start = profiler.clock()
+            self.count_frame(start)
+        if self.replay is not None:
+            self.update_replay()
+        try:
+            self.status_label.setText(self.pending_status.pop())
+        except IndexError:
+            pass
+        self.alarms.suppress(not self.engine.power_on)
+        if self.plot_dirty:
+            self.update_plot()
+        if profiler is not None:
+            profiler.add('frame', start)
+
+    def count_frame(self, now_ns):
+        # A frame that comes more than half an interval late counts as dropped
+        profiler = self.profiler
+        profiler.count('frames')
+        if self.last_frame is not None and now_ns - self.last_frame > 1.5e9 / self.refresh_rate:
+            profiler.count('late_frames')
+        self.last_frame = now_ns
+        if time.monotonic() - self.overlay_sample[0] >= 0.5:
+            self.update_overlay()
+
+    def performance_metrics(self):
+        # Rates since the previous call, next to the cumulative phase timings
+        now = time.monotonic()
+        since, ticks, frames = self.overlay_sample
+        counters = self.profiler.counters
+        elapsed = max(now - since, 1e-9)
+        self.overlay_sample = (now, self.engine.tick, counters.get('frames', 0))
+        target = self.speed / self.time_step if self.replay is None else self.replay_speed / self.time_step
+        return {
+            'sim_time': self.engine.time,
+            'ticks': self.engine.tick,
+            'achieved_steps_per_s': (self.engine.tick - ticks) / elapsed,
+            'target_steps_per_s': target,
+            'achieved_fps': (counters.get('frames', 0) - frames) / elapsed,
+            'target_fps': self.refresh_rate,
+            'dropped_steps': self.worker.dropped_steps,
+            'late_frames': counters.get('late_frames', 0),
+        }
+
+    def update_overlay(self):
+        metrics = self.performance_metrics()
+        phases = self.profiler.snapshot()['phases']
+        step = phases.get('step', {})
+        lines = [
+            f"tick   {step.get('mean_us', 0):8.1f} us  p99 {step.get('p99_us', 0):8.1f} us",
+            f"rate   {metrics['achieved_steps_per_s']:8.0f} / {metrics['target_steps_per_s']:g} steps/s",
+            f"fps    {metrics['achieved_fps']:8.1f} / {metrics['target_fps']:g}",
+            f"dropped steps {metrics['dropped_steps']}  late frames {metrics['late_frames']}",
+        ]
+        for name in ('pid', 'level', 'thresholds', 'alarms', 'logging', 'history', 'subscribers', 'plot', 'frame'):
+            if name in phases:
+                lines.append(f"{name:11s}{phases[name]['mean_us']:8.1f} us  max {phases[name]['max_us']:9.1f} us")
+        self.overlay.setText('\n'.join(lines))
+        self.overlay.adjustSize()
+        if self.metrics_path:
+            self.profiler.dump(self.metrics_path, **metrics)
+
+    def update_replay(self):
+        now = time.monotonic()
+        self.replay.advance(now - self.last_replay_tick)
+        self.last_replay_tick = now
+        replay = self.replay
+        span = replay.end_time - replay.start_time
+        if span > 0 and not self.seek_slider.isSliderDown():
+            self.seek_slider.setValue(int(1000 * (replay.clock - replay.start_time) / span))
+        if replay.finished:
+            self.timer.stop()
+            self.status_label.setText(f"Replay finished: {self.replay_path}")
+
+    def seek_replay(self):
+        replay = self.replay
+        replay.seek(replay.start_time + self.seek_slider.value() / 1000 * (replay.end_time - replay.start_time))
+        self.last_replay_tick = time.monotonic()
+        self.alarms.sync(self.engine.thresholds)
+        if not self.timer.isActive():
+            self.timer.start(int(1000 / self.refresh_rate))
+
+    def on_engine_update(self, engine, status):
+        # Called on the worker thread: only hand results over, the timer applies them to the widgets
+        if status:
+            self.pending_status.append(status)
+        if engine.power_on:
+            self.plot_dirty = True
+
+    def update_plot(self, *args):
+        # Only fetch about one min/max pair per horizontal pixel of the visible range
+        profiler = self.profiler
+        if profiler is not None:
+            start = profiler.clock()
+        view_box = self.plot_widget.getViewBox()
+        if view_box.autoRangeEnabled()[0]:
+            x0, x1 = float('-inf'), float('inf')
         else:
-            return 0
-    
+            x0, x1 = view_box.viewRange()[0]
+        with self.worker.lock:
+            times, (levels1, levels2) = self.plot_lod.query(x0, x1, max_points=max(self.plot_widget.width(), 100))
+            times, levels1, levels2 = times.copy(), levels1.copy(), levels2.copy()
+        self.curve1.setData(times, levels1)
+        self.curve2.setData(times, levels2)
+        self.plot_dirty = False
+        if profiler is not None:
+            profiler.add('plot', start)
+
     def set_pid_parameters(self, kp, ki, kd):
-        self.Kp = kp
-        self.Ki = ki
-        self.Kd = kd
+        self.worker.call(self.engine.set_pid_parameters, kp, ki, kd)
 
     def set_setpoints(self, setpoint1, setpoint2):
-        self.setpoint1 = setpoint1
-        self.setpoint2 = setpoint2
-
-    def check_overflow(self):
-        if self.level1 >= self.tank1_max or self.level2 >= self.tank2_max:
-            self.status_label.setText("WARNING: Tank overflow detected!")
-
-    def check_failsafe(self):
-        if self.level1 >= 98 or self.level2 >= 98:
-            self.status_label.setText("EMERGENCY: Critical level reached. Shutting down pumps.")
+        self.worker.call(self.engine.set_setpoints, setpoint1, setpoint2)
 
-    def play_alarms(self):
-        if self.level1 >= 100 or self.level2 >= 100:
-            self.player_100.play()
-        elif self.level1 >= 95 or self.level2 >= 95:
-            self.player_95.play()
-        elif self.level1 >= 90 or self.level2 >= 90:
-            self.player_90.play()
+    def acknowledge_alarms(self):
+        self.alarms.acknowledge()
 
     def stop_simulation(self):
+        if self.stopped:
+            return
+        self.stopped = True
         self.timer.stop()
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"simulation_data_{timestamp}.csv"
-        self.logger.info("Simulation stopped")
-    
-        # Save data as CSV
-        with open(filename, 'w', newline='') as file:
-            writer = csv.writer(file)
-            writer.writerow(['Time', 'Tank1 Level', 'Tank2 Level'])
-            for t, l1, l2 in zip(self.times, self.levels1, self.levels2):
-                writer.writerow([t, l1, l2])
-        
-        self.status_label.setText(f"Simulation stopped. Data saved to {filename}")
-
-        # Save plot as image
-        plt.figure(figsize=(10, 6))
-        plt.plot(self.times, self.levels1, label='Tank 1')
-        plt.plot(self.times, self.levels2, label='Tank 2')
-        plt.xlabel('Time (s)')
-        plt.ylabel('Level (%)')
-        plt.title('Tank Simulation Results')
-        plt.legend()
-        plt.savefig('simulation_results.png')
-        self.close()
+        self.worker.stop()
+        if self.metrics_path:
+            self.profiler.dump(self.metrics_path, **self.performance_metrics())
+        self.alarms.stop()
+        if self.telemetry is not None:
+            self.telemetry.stop()
+        if self.modbus is not None:
+            self.modbus.stop()
+        self.logger.info("Simulation stopped", extra={'sim_time': self.engine.time, 'event': 'stopped'})
+
+        # Data has been streamed to disk during the run; only the last chunk is left to write
+        if self.recorder is not None:
+            self.recorder.close()
+            self.status_label.setText(f"Simulation stopped. Data saved to {self.data_filename}")
+
+        # The plot (decimated, Agg) and the optional report are written in the background, so the window closes
+        # right away; the log writer is stopped last so their messages still reach the log
+        from export import ExportWorker, export_history, write_report
+        self.exporter = ExportWorker(self.logger)
+        self.exporter.submit(export_history, self.engine.history, f"simulation_results_{self.run_timestamp}.png")
+        if self.report:
+            runs = sorted(glob.glob('simulation_data_*'))
+            self.exporter.submit(write_report, runs, f"simulation_report_{self.run_timestamp}.md")
+        self.exporter.submit(self.log_writer.stop)
+        self.exporter.shutdown(wait=False)
+
+    def closeEvent(self, event):
+        # The Stop button closes the window too, so closing it any way writes the recorder's last chunk and the
+        # queued log records before the daemon threads go away with the interpreter
+        self.stop_simulation()
+        event.accept()
 
     def simulate_power_loss(self):
-        self.power_on = not self.power_on
-        if self.power_on:
-            self.status_label.setText("System Status: Power Restored")
-            self.logger.info("Power restored")
-
-        else:
-            self.status_label.setText("System Status: Power Loss")
-            self.logger.warning("Power loss")
+        self.worker.call(self.engine.simulate_power_loss)
 
     def simulate_sensor_failure(self):
-        self.sensor_working = not self.sensor_working
-        if self.sensor_working:
-            self.status_label.setText("System Status: Sensors Restored")
-            self.logger.info("Sensors restored")
-
-        else:
-            self.status_label.setText("System Status: Sensor Failure")
-            self.logger.warning("Sensor failure occurred")
+        self.worker.call(self.engine.simulate_sensor_failure)
 
     def start_water_flow(self):
-        self.water_flow = True
-        self.status_label.setText("System Status: Water Flow Started")
-        self.logger.info("Water flow started")
+        self.worker.call(self.engine.start_water_flow)
 
     def stop_water_flow(self):
-        self.water_flow = False
-        self.status_label.setText("System Status: Water Flow Stopped")
-        self.logger.info("Water flow stopped")
-
+        self.worker.call(self.engine.stop_water_flow)
 
     def start_water_drain(self):
-        self.water_drain = True
-        self.status_label.setText("System Status: Water Drain Started")
-        self.logger.info("Water drain started")
-
+        self.worker.call(self.engine.start_water_drain)
 
     def stop_water_drain(self):
-        self.water_drain = False
-        self.status_label.setText("System Status: Water Drain Stopped")
-        self.logger.info("Water drain stopped")
+        self.worker.call(self.engine.stop_water_drain)
 
 
 
 if __name__ == '__main__':
-    app = QApplication(sys.argv)
-    sim = TankSimulation()
+    parser = argparse.ArgumentParser(description="Two-tank system simulation")
+    parser.add_argument('--history-window', type=float, default=3600, help="Seconds of history kept in memory and plotted")
+    parser.add_argument('--spill-history', metavar='PATH', help="Append samples older than the window to this file")
+    parser.add_argument('--record-format', choices=['csv', 'npz'], default='csv',
+                        help="Stream the run to a CSV file or to a directory of float32 .npz segments")
+    parser.add_argument('--replay', metavar='PATH', help="Play back a recorded run instead of simulating")
+    parser.add_argument('--speed', default='1',
+                        help="Simulated (or replayed) seconds per wall second, e.g. 1, 10, 100 or 'max'")
+    parser.add_argument('--time-step', type=float, default=0.1, help="Fixed simulation step in seconds, e.g. 0.001 for 1 kHz")
+    parser.add_argument('--refresh-rate', type=float, default=30, help="Display refreshes per second")
+    parser.add_argument('--integrator', choices=sorted(INTEGRATORS), default='euler',
+                        help="Level integrator; rk45 adapts its step and lands exactly on threshold crossings")
+    parser.add_argument('--network', metavar='PATH',
+                        help="JSON tank network layout whose first two tanks are tanks 1 and 2 (replaces --integrator)")
+    parser.add_argument('--log-file', default='tank_simulation.log', help="JSON-lines event log")
+    parser.add_argument('--log-max-bytes', type=int, default=10 * 1024 * 1024, help="Rotate the log at this size")
+    parser.add_argument('--log-flush-interval', type=float, default=1.0, help="Seconds between log file flushes")
+    parser.add_argument('--profile', action='store_true', help="Time each phase of the tick and show an overlay")
+    parser.add_argument('--metrics', metavar='PATH', help="Periodically dump profiling metrics to this JSON file")
+    parser.add_argument('--restore', metavar='PATH', help="Start from a checkpoint saved with --checkpoint")
+    parser.add_argument('--checkpoint', metavar='PATH', help="Save a binary checkpoint of the engine periodically")
+    parser.add_argument('--checkpoint-interval', type=float, default=60.0, help="Simulated seconds between checkpoints")
+    parser.add_argument('--report', action='store_true',
+                        help="After stopping, also write a summary report of every simulation_data_* run here")
+    parser.add_argument('--no-audio', action='store_true', help="Keep alarms silent and never load QtMultimedia")
+    parser.add_argument('--telemetry-port', type=int, metavar='PORT',
+                        help="Publish levels and events to telemetry readers on this localhost port")
+    parser.add_argument('--modbus-port', type=int, metavar='PORT',
+                        help="Serve levels, flags, setpoints and gains as Modbus TCP registers on this localhost port")
+    args, qt_args = parser.parse_known_args()
+
+    app = QApplication(sys.argv[:1] + qt_args)
+    speed = float('inf') if args.speed == 'max' else float(args.speed)
+    sim = TankSimulation(history_window=args.history_window, history_spill_path=args.spill_history,
+                         record_format=args.record_format, replay_path=args.replay, replay_speed=speed,
+                         time_step=args.time_step, speed=speed, refresh_rate=args.refresh_rate,
+                         integrator=args.integrator, log_file=args.log_file, log_max_bytes=args.log_max_bytes,
+                         log_flush_interval=args.log_flush_interval, profile=args.profile,
+                         metrics_path=args.metrics, restore_path=args.restore, checkpoint_path=args.checkpoint,
+                         checkpoint_interval=args.checkpoint_interval, report=args.report,
+                         audio=not args.no_audio, telemetry_port=args.telemetry_port,
+                         modbus_port=args.modbus_port, network_path=args.network)
     sim.show()
+    # Reported once the event loop is running, i.e. when the window is actually up
+    QTimer.singleShot(0, lambda: sim.logger.info(f"Startup took {time.perf_counter() - STARTED:.2f} s",
+                                                 extra={'event': 'startup'}))
     sys.exit(app.exec_())
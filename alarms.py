@@ -0,0 +1,171 @@
+import os
+import threading
+import time
+import wave
+from collections import namedtuple
+
+# Alarm level -> sound file; a higher level has priority over a lower one
+ALARM_SOUNDS = {
+    90: 'sound_90.wav',
+    95: 'sound_95.wav',
+    100: 'sound_100.wav',
+}
+
+Sound = namedtuple('Sound', ['name', 'frames', 'channels', 'sample_width', 'frame_rate', 'duration'])
+
+
+def load_sound(path):
+    # Decode a WAV file once into raw PCM frames
+    with wave.open(path, 'rb') as file:
+        frame_count = file.getnframes()
+        frames = file.readframes(frame_count)
+        return Sound(os.path.basename(path), frames, file.getnchannels(), file.getsampwidth(),
+                     file.getframerate(), frame_count / file.getframerate())
+
+
+# Sink for headless runs: remembers what would have been played
+class NullSink:
+    def __init__(self):
+        self.played = []
+
+    def prepare(self, sound):
+        pass
+
+    def play(self, sound):
+        self.played.append(sound.name)
+
+    def stop(self):
+        pass
+
+
+# Decides which alarm sounds and plays it on its own thread, so raising an alarm never blocks the caller.
+# Only the highest-priority alarm that has not been acknowledged sounds; it is repeated every
+# repeat_interval seconds while it stays up and raising an alarm that is already up does nothing. With
+# latching, an alarm keeps sounding after its level falls back until it is acknowledged.
+class AlarmManager:
+    def __init__(self, sink=None, sounds=None, directory='.', repeat_interval=2.0, latching=True, logger=None):
+        self.sink = sink if sink is not None else NullSink()
+        self.sounds = {level: load_sound(os.path.join(directory, name))
+                       for level, name in (ALARM_SOUNDS if sounds is None else sounds).items()}
+        for sound in self.sounds.values():
+            self.sink.prepare(sound)
+        self.repeat_interval = repeat_interval
+        self.latching = latching
+        self.logger = logger
+        self.active = set()
+        self.latched = set()
+        self.acknowledged = set()
+        self.suppressed = False
+        self.condition = threading.Condition()
+        self.stopping = False
+        self.thread = None
+        self.profiler = None
+
+    def attach(self, engine):
+        engine.thresholds.subscribe(self.on_threshold_events, kinds=['alarm'])
+        self.sync(engine.thresholds)
+
+    def on_threshold_events(self, events):
+        profiler = self.profiler
+        if profiler is not None:
+            start = profiler.clock()
+        for event in events:
+            if event.rising:
+                self.raise_alarm(event.threshold)
+            else:
+                self.clear_alarm(event.threshold)
+        if profiler is not None:
+            profiler.add('alarms', start)
+
+    def sync(self, registry):
+        # Take the alarm state straight from the registry, e.g. after its levels were reset without events
+        with self.condition:
+            self.active = {level for level in registry.active_thresholds('alarm') if level in self.sounds}
+            self.latched &= self.active
+            self.acknowledged &= self.active
+            self.condition.notify()
+
+    def raise_alarm(self, level):
+        with self.condition:
+            if level not in self.sounds or level in self.active:
+                return
+            self.active.add(level)
+            self.acknowledged.discard(level)
+            if self.latching:
+                self.latched.add(level)
+            self.condition.notify()
+
+    def clear_alarm(self, level):
+        with self.condition:
+            if level not in self.active:
+                return
+            self.active.discard(level)
+            if level not in self.latched:
+                self.acknowledged.discard(level)
+            self.condition.notify()
+
+    def acknowledge(self, level=None):
+        # Silence one alarm, or every alarm that is currently up; latched alarms that have cleared are dropped
+        with self.condition:
+            levels = self.active | self.latched if level is None else {level}
+            self.acknowledged |= levels & self.active
+            self.latched -= levels
+            if self.logger is not None and levels:
+                self.logger.info(f"Alarm acknowledged: {', '.join(f'{level:g}%' for level in sorted(levels))}",
+                                 extra={'event': 'alarm_acknowledged'})
+            self.condition.notify()
+
+    def suppress(self, suppressed):
+        with self.condition:
+            if suppressed != self.suppressed:
+                self.suppressed = suppressed
+                self.condition.notify()
+
+    def sounding(self):
+        # Highest-priority alarm that should be heard right now, or None
+        with self.condition:
+            if self.suppressed:
+                return None
+            pending = (self.active | self.latched) - self.acknowledged
+            return max(pending) if pending else None
+
+    def start(self):
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.stopping = False
+        self.thread = threading.Thread(target=self._run, name='AlarmManager', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.stopping = True
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.sink.stop()
+
+    def _run(self):
+        playing = None
+        with self.condition:
+            while not self.stopping:
+                level = self.sounding()
+                if level is None:
+                    if playing is not None:
+                        self.sink.stop()
+                        playing = None
+                    self.condition.wait()
+                    continue
+                if level != playing:
+                    # A new or higher-priority alarm cuts off whatever is playing
+                    self.sink.stop()
+                    playing = level
+                sound = self.sounds[level]
+                self.sink.play(sound)
+                # Sleep until the repeat is due; any change in alarm state wakes the thread early
+                due = time.monotonic() + sound.duration + self.repeat_interval
+                while not self.stopping and self.sounding() == playing:
+                    remaining = due - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
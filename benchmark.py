@@ -0,0 +1,262 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time as wall_time
+from datetime import datetime
+
+import numpy as np
+
+from integrators import INTEGRATORS
+from recorder import RunRecorder
+from tank_engine import TankEngine
+
+PERCENTILES = (50, 90, 99, 99.9)
+HISTORY_LENGTHS = (1000, 10000, 100000, 1000000)
+QUICK_HISTORY_LENGTHS = (1000, 10000, 100000)
+STARTUP_MODULES = ('tank_engine', 'tank_batch', 'scenario', 'campaign', 'TankSimulation_Live_Improved')
+# Modules that should only load on first use; any of these showing up after a plain import is reported
+LAZY_MODULES = ('matplotlib', 'PyQt5.QtMultimedia', 'logging.handlers', 'yaml')
+
+
+def latency_stats(samples_ns):
+    samples = np.asarray(samples_ns, dtype=float) / 1000.0
+    stats = {f'p{q:g}_us': float(np.percentile(samples, q)) for q in PERCENTILES}
+    stats['max_us'] = float(samples.max())
+    stats['mean_us'] = float(samples.mean())
+    return stats
+
+
+def timed(function, repeat):
+    # Per-call latencies in nanoseconds
+    clock = wall_time.perf_counter_ns
+    samples = np.empty(repeat, dtype=np.int64)
+    for i in range(repeat):
+        started = clock()
+        function()
+        samples[i] = clock() - started
+    return samples
+
+
+def bench_engine(steps, integrator='euler'):
+    engine = TankEngine(integrator=INTEGRATORS[integrator](), history_window=steps * 0.1)
+    engine.start_water_flow()
+    started = wall_time.perf_counter()
+    engine.run(steps=steps)
+    elapsed = wall_time.perf_counter() - started
+    latencies = timed(engine.step, min(steps, 20000))
+    return {'steps': steps, 'steps_per_s': steps / elapsed, 'step_latency': latency_stats(latencies)}
+
+
+def bench_pid_control(calls):
+    engine = TankEngine(record_history=False)
+    state = [0.0, 0.0]
+
+    def call():
+        _, state[0], state[1] = engine.pid_control(40.0, 50.0, state[0], state[1])
+
+    latencies = timed(call, calls)
+    return {'calls_per_s': calls / (latencies.sum() / 1e9), 'call_latency': latency_stats(latencies)}
+
+
+def bench_export(rows, directory):
+    results = {}
+    engine = TankEngine(history_window=rows * 0.1)
+    engine.start_water_flow()
+    engine.run(steps=rows)
+    times, levels1, levels2 = (engine.history.read_all(name) for name in ('time', 'level1', 'level2'))
+    for format in ('csv', 'npz'):
+        path = os.path.join(directory, 'export.csv' if format == 'csv' else 'export_npz')
+        started = wall_time.perf_counter()
+        recorder = RunRecorder(path, format=format)
+        for tick, (time, level1, level2) in enumerate(zip(times.tolist(), levels1.tolist(), levels2.tolist())):
+            recorder.record(tick, time, level1, level2)
+        recorder.close()
+        elapsed = wall_time.perf_counter() - started
+        size = os.path.getsize(path) if format == 'csv' else sum(
+            os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+        results[format] = {'rows': rows, 'rows_per_s': rows / elapsed, 'mb_per_s': size / elapsed / 1e6}
+    return results
+
+
+def bench_startup(repeat=3):
+    # Cold import time of each entry point in a fresh interpreter (best of repeat), plus the whole process
+    script = ("import sys, time; started = time.perf_counter(); import {module}; "
+              "print(time.perf_counter() - started); print(','.join(name for name in {lazy!r} if name in sys.modules))")
+    environment = dict(os.environ, QT_QPA_PLATFORM='offscreen')
+    directory = os.path.dirname(os.path.abspath(__file__))
+    results = {}
+    for module in STARTUP_MODULES:
+        imports, processes, loaded = [], [], ''
+        for _ in range(repeat):
+            started = wall_time.perf_counter()
+            completed = subprocess.run([sys.executable, '-c', script.format(module=module, lazy=LAZY_MODULES)],
+                                       capture_output=True, text=True, cwd=directory, env=environment)
+            processes.append(wall_time.perf_counter() - started)
+            if completed.returncode:
+                break
+            output = completed.stdout.split('\n')
+            imports.append(float(output[0]))
+            loaded = output[1]
+        if completed.returncode:
+            results[module] = {'skipped': completed.stderr.strip().splitlines()[-1]}
+        else:
+            results[module] = {'import_seconds': min(imports), 'process_seconds': min(processes),
+                               'eager': loaded.split(',') if loaded else []}
+    return results
+
+
+def bench_gui(history_lengths, ticks, directory):
+    # Runs the real window on the offscreen platform; physics is driven here, not by the worker thread
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    try:
+        from PyQt5.QtWidgets import QApplication
+        import TankSimulation_Live_Improved as gui
+    except (ImportError, OSError) as error:
+        return {'skipped': f"GUI unavailable: {error}"}
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    results = {'redraw': [], 'update_simulation': None, 'stop_export': []}
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        for length in history_lengths:
+            sim = gui.TankSimulation(history_window=length * 0.1, log_file=None)
+            sim.worker.stop()
+            sim.timer.stop()
+            sim.show()
+            engine = sim.engine
+            engine.start_water_flow()
+            engine.run(steps=length)
+
+            def redraw():
+                sim.update_plot()
+                app.processEvents()
+
+            lod = timed(redraw, 20)
+            with sim.worker.lock:
+                raw_times, raw_levels = engine.times.copy(), engine.levels1.copy()
+            raw = timed(lambda: (sim.curve1.setData(raw_times, raw_levels), app.processEvents()), 5)
+            results['redraw'].append({'history': length, 'lod': latency_stats(lod), 'raw_set_data': latency_stats(raw)})
+
+            if results['update_simulation'] is None:
+                def tick():
+                    engine.step()
+                    sim.plot_dirty = True
+                    sim.update_simulation()
+                    app.processEvents()
+
+                results['update_simulation'] = latency_stats(timed(tick, ticks))
+
+            started = wall_time.perf_counter()
+            sim.stop_simulation()
+            stopped = wall_time.perf_counter()
+            sim.exporter.shutdown(wait=True)
+            results['stop_export'].append({'history': length, 'seconds': stopped - started,
+                                           'export_seconds': wall_time.perf_counter() - started})
+    finally:
+        os.chdir(cwd)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(quick=False, gui=True):
+    directory = tempfile.mkdtemp(prefix='tank_benchmark_')
+    try:
+        scale = 10 if quick else 1
+        results = {
+            'engine_euler': bench_engine(200000 // scale),
+            'engine_rk4': bench_engine(50000 // scale, 'rk4'),
+            'pid_control': bench_pid_control(200000 // scale),
+            'export': bench_export(200000 // scale, directory),
+            'startup': bench_startup(),
+        }
+        if gui:
+            results['gui'] = bench_gui(QUICK_HISTORY_LENGTHS if quick else HISTORY_LENGTHS, 2000 // scale, directory)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return {
+        'commit': git_commit(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'quick': quick,
+        'results': results,
+    }
+
+
+def flatten(results, prefix=''):
+    # {'a': {'b': 1}} -> {'a.b': 1}; list entries are keyed by their history length, other lists (such as the
+    # eager module names) are not metrics and are left out
+    values = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            values.update(flatten(value, name + '.'))
+        elif isinstance(value, list):
+            for entry in value:
+                if not isinstance(entry, dict):
+                    continue
+                values.update(flatten({k: v for k, v in entry.items() if k != 'history'}, f"{name}[{entry['history']}]."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[name] = value
+    return values
+
+
+def compare(baseline, current, tolerance=0.1):
+    # Throughputs (*_per_s) regress when they drop, latencies and durations when they grow
+    old, new = flatten(baseline['results']), flatten(current['results'])
+    regressions = []
+    print(f"{'metric':60s} {baseline.get('commit') or 'baseline':>12s} {current.get('commit') or 'current':>12s}  change")
+    for name in sorted(old.keys() & new.keys()):
+        if name.endswith(('.steps', '.rows')) or old[name] == 0:
+            continue
+        change = new[name] / old[name] - 1
+        worse = -change if name.endswith('_per_s') else change
+        flag = '  REGRESSION' if worse > tolerance else ''
+        if flag:
+            regressions.append(name)
+        print(f"{name:60s} {old[name]:12.4g} {new[name]:12.4g} {change:+7.1%}{flag}")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the engine, plot updates and data export.")
+    parser.add_argument('--quick', action='store_true', help="Smaller workloads for a fast check")
+    parser.add_argument('--no-gui', action='store_true', help="Skip the offscreen Qt benchmarks")
+    parser.add_argument('--out', help="Results JSON file (default benchmark_<commit>.json)")
+    parser.add_argument('--compare', nargs='+', metavar='JSON',
+                        help="Compare a baseline results file against another one (or a fresh run)")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="Relative change reported as a regression")
+    args = parser.parse_args()
+
+    if args.compare and len(args.compare) == 2:
+        with open(args.compare[0]) as file:
+            baseline = json.load(file)
+        with open(args.compare[1]) as file:
+            current = json.load(file)
+    else:
+        current = run_benchmarks(quick=args.quick, gui=not args.no_gui)
+        out = args.out or f"benchmark_{current['commit'] or datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+        with open(out, 'w') as file:
+            json.dump(current, file, indent=2)
+        print(f"Results saved to {out}")
+        baseline = None
+        if args.compare:
+            with open(args.compare[0]) as file:
+                baseline = json.load(file)
+    if baseline is not None:
+        sys.exit(1 if compare(baseline, current, args.tolerance) else 0)
+    for name, value in flatten(current['results']).items():
+        print(f"{name:60s} {value:12.4g}")
@@ -0,0 +1,176 @@
+import argparse
+import json
+import math
+import os
+import time as wall_time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from tank_batch import TankBatch
+from tank_sweep import write_results
+
+# A value is either fixed or a (low, high) tuple drawn uniformly per run. Rates are events per simulated second.
+CAMPAIGN_DEFAULTS = {
+    'setpoint': 50.0,
+    'noise_std': 0.5,  # sensor noise, % level
+    'dropout_rate': 1 / 600,  # per tank
+    'dropout_duration': (1.0, 10.0),
+    'power_loss_rate': 1 / 1200,
+    'power_loss_duration': (5.0, 60.0),
+    'inflow_sigma': 0.1,  # relative inflow disturbance
+    'inflow_tau': 30.0,  # correlation time of the disturbance, s
+}
+RESULT_COLUMNS = ('setpoint1', 'setpoint2', 'max_level1', 'max_level2', 'overshoot1', 'overshoot2',
+                  'failsafe_time', 'power_losses', 'dropouts')
+CHUNK_RUNS = 1024  # fixed so results for a seed do not depend on the number of processes
+
+
+def _draw(rng, value, shape):
+    if isinstance(value, tuple):
+        return rng.uniform(value[0], value[1], shape)
+    return np.full(shape, float(value))
+
+
+def _durations(rng, value, count, time_step):
+    return np.maximum(np.round(_draw(rng, value, count) / time_step), 1).astype(np.int64)
+
+
+def _run_chunk(shm_name, n_runs, start, stop, params, duration, time_step, seed, failsafe_level):
+    # Simulates runs [start, stop) as one TankBatch and writes their rows into the shared result array
+    rng = np.random.default_rng([seed, start // CHUNK_RUNS])
+    n = stop - start
+    batch = TankBatch(n, 2, time_step=time_step)
+    batch.failsafe_level[...] = failsafe_level
+    batch.setpoint[...] = _draw(rng, params['setpoint'], (n, 2))
+    batch.water_flow[...] = True
+
+    shape = batch.shape
+    power_left = np.zeros((n, 1), dtype=np.int64)
+    dropout_left = np.zeros(shape, dtype=np.int64)
+    power_losses = np.zeros(n, dtype=np.int64)
+    dropouts = np.zeros(n, dtype=np.int64)
+    inflow = np.zeros(shape)
+    decay = math.exp(-time_step / params['inflow_tau'])
+    kick = params['inflow_sigma'] * math.sqrt(1 - decay ** 2)
+    failsafe_time = np.full(n, np.nan)
+
+    for tick in range(int(round(duration / time_step))):
+        # Power losses hit both tanks of a run; sensor dropouts hit one tank
+        starting = (power_left == 0) & (rng.random((n, 1)) < params['power_loss_rate'] * time_step)
+        power_left[starting] = _durations(rng, params['power_loss_duration'], int(starting.sum()), time_step)
+        power_losses += starting[:, 0]
+        batch.power_on[...] = power_left == 0
+        power_left = np.maximum(power_left - 1, 0)
+
+        starting = (dropout_left == 0) & (rng.random(shape) < params['dropout_rate'] * time_step)
+        dropout_left[starting] = _durations(rng, params['dropout_duration'], int(starting.sum()), time_step)
+        dropouts += starting.sum(axis=1)
+        batch.sensor_working[...] = dropout_left == 0
+        dropout_left = np.maximum(dropout_left - 1, 0)
+
+        inflow = decay * inflow + kick * rng.standard_normal(shape)
+        batch.step(inflow_scale=np.maximum(1 + inflow, 0), measurement_noise=rng.normal(0, params['noise_std'], shape))
+
+        reached = np.isnan(failsafe_time) & batch.failsafe.any(axis=1)
+        failsafe_time[reached] = (tick + 1) * time_step
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        results = np.ndarray((n_runs, len(RESULT_COLUMNS)), dtype=np.float64, buffer=shm.buf)
+        overshoot = np.maximum(batch.max_level - batch.setpoint, 0)
+        results[start:stop] = np.column_stack([batch.setpoint, batch.max_level, overshoot, failsafe_time,
+                                               power_losses, dropouts])
+        del results
+    finally:
+        shm.close()
+    return stop - start
+
+
+def run_campaign(n_runs, params=None, duration=3600, time_step=0.1, seed=0, failsafe_level=98.0, processes=None):
+    params = {name: (params or {}).get(name, default) for name, default in CAMPAIGN_DEFAULTS.items()}
+    bounds = list(range(0, n_runs, CHUNK_RUNS)) + [n_runs]
+    chunks = list(zip(bounds[:-1], bounds[1:]))
+
+    # Workers write straight into one shared (n_runs, columns) array instead of pickling results back
+    shm = shared_memory.SharedMemory(create=True, size=max(n_runs * len(RESULT_COLUMNS) * 8, 1))
+    try:
+        arguments = [(shm.name, n_runs, start, stop, params, duration, time_step, seed, failsafe_level)
+                     for start, stop in chunks]
+        if processes == 1 or len(chunks) < 2:
+            for argument in arguments:
+                _run_chunk(*argument)
+        else:
+            with ProcessPoolExecutor(max_workers=processes) as pool:
+                list(pool.map(_run_chunk, *zip(*arguments)))
+        table = np.ndarray((n_runs, len(RESULT_COLUMNS)), dtype=np.float64, buffer=shm.buf).copy()
+    finally:
+        shm.close()
+        shm.unlink()
+    return {column: table[:, i] for i, column in enumerate(RESULT_COLUMNS)}
+
+
+def summarize(results):
+    failsafe_time = results['failsafe_time']
+    n = len(failsafe_time)
+    reached = np.count_nonzero(~np.isnan(failsafe_time))
+    p = reached / n if n else float('nan')
+    # Wilson score interval, which stays sensible when almost no run (or every run) reaches the failsafe
+    z = 1.959964
+    centre = (p + z * z / (2 * n)) / (1 + z * z / n) if n else float('nan')
+    half = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / (1 + z * z / n) if n else float('nan')
+    overshoot = np.maximum(results['overshoot1'], results['overshoot2'])
+    return {
+        'runs': n,
+        'failsafe_runs': int(reached),
+        'p_failsafe': p,
+        'p_failsafe_ci95': [max(centre - half, 0.0), min(centre + half, 1.0)],
+        'median_failsafe_time': float(np.median(failsafe_time[~np.isnan(failsafe_time)])) if reached else None,
+        'worst_overshoot': float(overshoot.max()) if n else None,
+        'overshoot_percentiles': {str(q): float(np.percentile(overshoot, q)) for q in (50, 95, 99, 99.9)} if n else {},
+        'mean_power_losses': float(results['power_losses'].mean()) if n else None,
+        'mean_dropouts': float(results['dropouts'].mean()) if n else None,
+    }
+
+
+def _parse_value(text):
+    if ':' in text:
+        low, high = (float(part) for part in text.split(':'))
+        return low, high
+    return float(text)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Monte Carlo campaign of seeded sensor noise, dropouts, power losses and inflow disturbances. "
+                    "Values are a number or low:high for a uniform draw per run.")
+    for name, default in CAMPAIGN_DEFAULTS.items():
+        text = f"{default[0]}:{default[1]}" if isinstance(default, tuple) else str(default)
+        parser.add_argument('--' + name.replace('_', '-'), dest=name, default=text)
+    parser.add_argument('--runs', type=int, default=10000)
+    parser.add_argument('--duration', type=float, default=3600)
+    parser.add_argument('--time-step', type=float, default=0.1)
+    parser.add_argument('--failsafe-level', type=float, default=98.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--processes', type=int)
+    parser.add_argument('--out', help="Write one row per run to this CSV file")
+    parser.add_argument('--summary', help="Write the aggregated statistics to this JSON file")
+    args = parser.parse_args()
+
+    params = {name: _parse_value(getattr(args, name)) for name in CAMPAIGN_DEFAULTS}
+    started = wall_time.perf_counter()
+    results = run_campaign(args.runs, params, args.duration, args.time_step, args.seed, args.failsafe_level,
+                           args.processes or os.cpu_count())
+    elapsed = wall_time.perf_counter() - started
+    summary = summarize(results)
+    if args.out:
+        write_results(results, args.out)
+    if args.summary:
+        with open(args.summary, 'w') as file:
+            json.dump(summary, file, indent=2)
+    low, high = summary['p_failsafe_ci95']
+    print(f"Ran {summary['runs']} runs of {args.duration:g} s in {elapsed:.2f} s")
+    print(f"P(reach {args.failsafe_level:g}%) = {summary['p_failsafe']:.4f} (95% CI {low:.4f}-{high:.4f}), "
+          f"worst-case overshoot {summary['worst_overshoot']:.2f}%, "
+          f"99th percentile {summary['overshoot_percentiles']['99']:.2f}%")
@@ -0,0 +1,153 @@
+import os
+import struct
+
+import numpy as np
+
+from integrators import INTEGRATORS
+from tank_batch import TankBatch
+from tank_engine import TankEngine
+
+MAGIC = b'TKCP'
+VERSION = 1
+
+# (attribute, struct code) of every scalar that makes up the engine state, in file order
+FIELDS = (
+    ('tick', 'q'), ('time', 'd'), ('time_step', 'd'),
+    ('level1', 'd'), ('level2', 'd'), ('tank1_max', 'd'), ('tank2_max', 'd'),
+    ('power_on', '?'), ('sensor_working', '?'), ('water_flow', '?'), ('water_drain', '?'),
+    ('setpoint1', 'd'), ('setpoint2', 'd'), ('Kp', 'd'), ('Ki', 'd'), ('Kd', 'd'),
+    ('integral1', 'd'), ('integral2', 'd'), ('prev_error1', 'd'), ('prev_error2', 'd'),
+    ('failsafe_level', 'd'),
+)
+STATE = struct.Struct('<' + ''.join(code for _, code in FIELDS) + '4d4d')
+# Integrator name, adaptive step size (NaN for fixed-step integrators), threshold bands, history header
+TAIL = struct.Struct('<8sd2q2q')
+
+
+def snapshot(engine, include_history=True):
+    # The whole engine state as a compact little-endian binary blob
+    state = STATE.pack(*(getattr(engine, name) for name, _ in FIELDS), *engine.thresholds1, *engine.thresholds2)
+    integrator = next((name for name, cls in INTEGRATORS.items() if type(engine.integrator) is cls),
+                      getattr(engine.integrator, 'name', 'euler'))
+    history = engine.history
+    size = len(history) if include_history and engine.record_history else 0
+    band = engine.thresholds.band
+    tail = TAIL.pack(integrator.encode(), getattr(engine.integrator, 'step_size', float('nan')),
+                     int(band[0]), int(band[1]), size, history.count)
+    samples = history.data[:, history.start:history.start + size].tobytes() if size else b''
+    return MAGIC + struct.pack('<H', VERSION) + state + tail + samples
+
+
+def restore(engine, data):
+    # Puts a snapshot back into an existing engine; subscribers are kept
+    if data[:4] != MAGIC:
+        raise ValueError("Not a tank simulation checkpoint")
+    version, = struct.unpack_from('<H', data, 4)
+    if version != VERSION:
+        raise ValueError(f"Unsupported checkpoint version {version}")
+    offset = 6
+    previous_time_step = engine.time_step
+    values = STATE.unpack_from(data, offset)
+    offset += STATE.size
+    for (name, _), value in zip(FIELDS, values):
+        setattr(engine, name, value)
+    engine.thresholds1 = values[len(FIELDS):len(FIELDS) + 4]
+    engine.thresholds2 = values[len(FIELDS) + 4:]
+    integrator, step_size, band1, band2, size, count = TAIL.unpack_from(data, offset)
+    offset += TAIL.size
+
+    integrator = integrator.rstrip(b'\0').decode()
+    if integrator not in INTEGRATORS:
+        # e.g. a tank network, which the checkpoint does not hold; only an engine already set up with one fits
+        if getattr(engine.integrator, 'name', None) != integrator:
+            raise ValueError(f"Checkpoint needs an engine that uses the {integrator} integrator")
+    elif type(engine.integrator) is not INTEGRATORS[integrator]:
+        engine.integrator = INTEGRATORS[integrator]()
+    if hasattr(engine.integrator, 'step_size'):
+        engine.integrator.step_size = step_size
+    engine.build_thresholds()
+    engine.thresholds.restore([band1, band2])
+    alarm_level = engine.thresholds.highest_active('alarm')
+    engine.alarm_level = None if alarm_level is None else int(alarm_level)
+
+    if engine.time_step != previous_time_step:
+        # A different step needs a different number of samples for the same window
+        engine.build_history()
+    history = engine.history
+    if size:
+        samples = np.frombuffer(data, dtype=np.float64, count=len(history.columns) * size, offset=offset)
+        history.load(samples.reshape(len(history.columns), size), count)
+    else:
+        history.clear()
+        history.count = count
+    return engine
+
+
+def save_checkpoint(engine, path, include_history=True):
+    # Written next to the target and renamed, so a crash never leaves a half-written checkpoint
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as file:
+        file.write(snapshot(engine, include_history))
+    os.replace(temporary, path)
+
+
+def load_checkpoint(path, engine=None, **engine_options):
+    with open(path, 'rb') as file:
+        data = file.read()
+    if engine is None:
+        engine = TankEngine(**{'time_step': time_step(data), **engine_options})
+    return restore(engine, data)
+
+
+def time_step(data):
+    # Read ahead of restoring, so a new engine can be sized for the snapshot's time step
+    return struct.unpack_from('<d', data, 6 + struct.calcsize('<qd'))[0]
+
+
+def fork(data, n, **engine_options):
+    # n independent engines continuing from the same snapshot
+    return [restore(TankEngine(**{'time_step': time_step(data), **engine_options}), data) for _ in range(n)]
+
+
+def fork_batch(data, n_scenarios):
+    # A TankBatch whose every scenario starts from the snapshot, for vectorized what-if runs
+    engine = restore(TankEngine(time_step=time_step(data), record_history=False), data)
+    batch = TankBatch(n_scenarios, 2, time_step=engine.time_step)
+    batch.tank_max[...] = (engine.tank1_max, engine.tank2_max)
+    batch.level[...] = (engine.level1, engine.level2)
+    batch.prev_level[...] = batch.level
+    batch.max_level[...] = batch.level
+    batch.time[...] = engine.time
+    batch.power_on[...] = engine.power_on
+    batch.sensor_working[...] = engine.sensor_working
+    batch.water_flow[...] = engine.water_flow
+    batch.water_drain[...] = engine.water_drain
+    batch.setpoint[...] = (engine.setpoint1, engine.setpoint2)
+    batch.set_pid_parameters(engine.Kp, engine.Ki, engine.Kd)
+    batch.integral[...] = (engine.integral1, engine.integral2)
+    batch.prev_error[...] = (engine.prev_error1, engine.prev_error2)
+    batch.thresholds[:, 0] = engine.thresholds1
+    batch.thresholds[:, 1] = engine.thresholds2
+    batch.failsafe_level[...] = engine.failsafe_level
+    return batch
+
+
+# Engine subscriber that saves a checkpoint every interval simulated seconds
+class Checkpointer:
+    def __init__(self, path, interval=60.0, include_history=True):
+        self.path = path
+        self.interval = interval
+        self.include_history = include_history
+        self.next_time = None
+
+    def attach(self, engine):
+        self.next_time = engine.time + self.interval
+        engine.subscribe(self.on_engine_update)
+
+    def detach(self, engine):
+        engine.unsubscribe(self.on_engine_update)
+
+    def on_engine_update(self, engine, status):
+        if engine.time >= self.next_time:
+            save_checkpoint(engine, self.path, self.include_history)
+            self.next_time = engine.time + self.interval
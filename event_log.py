@@ -0,0 +1,153 @@
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+import time as wall_time
+
+# Record attributes copied into every JSON line when present (passed with extra={...})
+STRUCTURED_FIELDS = ('sim_time', 'tank', 'event', 'threshold')
+
+
+# One JSON object per line: wall-clock timestamp, level, logger, message and the structured fields
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': round(record.created, 6),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for field in STRUCTURED_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry)
+
+
+# QueueHandler that keeps the traceback apart from the message: the stock prepare() folds it into msg and clears
+# exc_info, so JsonFormatter could never emit it. The text is kept in exc_text, which JsonFormatter writes as the
+# exception field and the standard Formatter still appends to the console line.
+class StructuredQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        exc_text = record.exc_text
+        if record.exc_info and not exc_text:
+            exc_text = logging.Formatter().formatException(record.exc_info)
+        record = copy.copy(record)
+        record.message = record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        record.exc_text = exc_text
+        return record
+
+
+# Size-rotated log file whose stream is flushed at most once per flush_interval instead of after every record
+class BatchedRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    def __init__(self, filename, max_bytes=10 * 1024 * 1024, backup_count=5, flush_interval=1.0):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+        self.flush_interval = flush_interval
+        self.last_flush = wall_time.monotonic()
+
+    def flush(self, force=False):
+        now = wall_time.monotonic()
+        if force or now - self.last_flush >= self.flush_interval:
+            super().flush()
+            self.last_flush = now
+
+    def close(self):
+        self.flush(force=True)
+        super().close()
+
+
+# Background writer for a QueueHandler: takes records off the queue in batches, hands them to the real
+# handlers and forces a flush whenever the queue has been quiet for flush_interval.
+class LogWriter:
+    def __init__(self, log_queue, handlers, flush_interval=1.0, batch_size=1024):
+        self.queue = log_queue
+        self.handlers = handlers
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.thread = None
+        self.stop_event = threading.Event()
+
+    def start(self):
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name='LogWriter', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self._drain()
+        for handler in self.handlers:
+            handler.close()
+
+    def _handle(self, record):
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def _drain(self):
+        count = 0
+        while count < self.batch_size or self.stop_event.is_set():
+            try:
+                record = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            self._handle(record)
+            count += 1
+        return count
+
+    def _flush(self, force):
+        for handler in self.handlers:
+            if isinstance(handler, BatchedRotatingFileHandler):
+                handler.flush(force=force)
+            else:
+                handler.flush()
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            try:
+                record = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                self._flush(force=True)
+                continue
+            self._handle(record)
+            self._drain()
+            self._flush(force=False)
+
+
+def setup_logging(logger='TankSimulation', filename='tank_simulation.log', max_bytes=10 * 1024 * 1024,
+                  backup_count=5, flush_interval=1.0, console=True, level=logging.INFO):
+    # Route a logger through a queue so callers only pay for an enqueue; returns the started LogWriter,
+    # which must be stopped to write out the last records
+    if isinstance(logger, str):
+        logger = logging.getLogger(logger)
+    handlers = []
+    if filename:
+        file_handler = BatchedRotatingFileHandler(filename, max_bytes=max_bytes, backup_count=backup_count,
+                                                  flush_interval=flush_interval)
+        file_handler.setFormatter(JsonFormatter())
+        handlers.append(file_handler)
+    if console:
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+        handlers.append(console_handler)
+
+    log_queue = queue.SimpleQueue()
+    for handler in list(logger.handlers):
+        if isinstance(handler, logging.handlers.QueueHandler):
+            logger.removeHandler(handler)
+    logger.addHandler(StructuredQueueHandler(log_queue))
+    logger.setLevel(level)
+    logger.propagate = False
+    writer = LogWriter(log_queue, handlers, flush_interval=flush_interval)
+    writer.start()
+    return writer
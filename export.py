@@ -0,0 +1,112 @@
+import argparse
+import glob
+import logging
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+from lod import minmax_decimate
+from run_analysis import analyze_runs, load_run, write_table
+
+PLOT_POINTS = 4000  # min/max pairs per curve; far more than a saved figure can show
+
+
+def decimate(times, levels, max_points=PLOT_POINTS):
+    bucket = max(1, math.ceil(len(times) / max_points))
+    return minmax_decimate(np.asarray(times), [np.asarray(level) for level in levels], bucket)
+
+
+def render_plot(times, levels, path, title='Tank Simulation Results', labels=('Tank 1', 'Tank 2'),
+                max_points=PLOT_POINTS):
+    # Figure + Agg canvas directly: no pyplot global state and no GUI backend, so this is safe off the main thread
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    times, levels = decimate(times, levels, max_points)
+    figure = Figure(figsize=(10, 6))
+    FigureCanvasAgg(figure)
+    axes = figure.add_subplot()
+    for level, label in zip(levels, labels):
+        axes.plot(times, level, label=label)
+    axes.set_xlabel('Time (s)')
+    axes.set_ylabel('Level (%)')
+    axes.set_title(title)
+    axes.legend()
+    figure.savefig(path)
+    return path
+
+
+def export_history(history, path, max_points=PLOT_POINTS):
+    # Full run, including samples spilled out of the in-memory window
+    return render_plot(history.read_all('time'), [history.read_all(name) for name in history.columns[1:]],
+                       path, max_points=max_points)
+
+
+def write_report(paths, out, plots=True, processes=None):
+    # Markdown summary of many recorded runs: the run_analysis table, a CSV copy and optionally one plot per run
+    rows = analyze_runs(paths, processes)
+    base = os.path.splitext(out)[0]
+    if rows:
+        write_table(rows, base + '.csv')
+    lines = ["# Tank simulation report", "", f"Generated {datetime.now():%Y-%m-%d %H:%M:%S} from {len(paths)} runs.", ""]
+    if rows:
+        columns = list(rows[0])
+        lines.append('| ' + ' | '.join(columns) + ' |')
+        lines.append('|' + '---|' * len(columns))
+        for row in rows:
+            lines.append('| ' + ' | '.join(f"{value:.2f}" if isinstance(value, float) else str(value)
+                                           for value in row.values()) + ' |')
+        lines.append("")
+    if plots:
+        directory = base + '_plots'
+        os.makedirs(directory, exist_ok=True)
+        for path in paths:
+            run = load_run(path)
+            if not len(run):
+                continue
+            name = os.path.basename(path.rstrip('/\\'))
+            image = os.path.join(directory, os.path.splitext(name)[0] + '.png')
+            render_plot(run.time, run.levels, image, title=name)
+            lines += [f"## {name}", "", f"![{name}]({os.path.relpath(image, os.path.dirname(os.path.abspath(out)))})", ""]
+    with open(out, 'w') as file:
+        file.write('\n'.join(lines))
+    return out
+
+
+# Runs export jobs one after another on a background thread. Pending jobs still finish after the window is
+# closed, since the interpreter waits for the executor before exiting.
+class ExportWorker:
+    def __init__(self, logger=None):
+        self.logger = logger if logger is not None else logging.getLogger('TankSimulation')
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='Export')
+
+    def submit(self, function, *args, **kwargs):
+        future = self.executor.submit(function, *args, **kwargs)
+        future.add_done_callback(self._report)
+        return future
+
+    def _report(self, future):
+        error = future.exception()
+        if error is not None:
+            self.logger.error(f"Export failed: {error}", extra={'event': 'export_failed'})
+        elif isinstance(future.result(), str):
+            self.logger.info(f"Exported {future.result()}", extra={'event': 'exported'})
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Write a summary report (Markdown + CSV + plots) for recorded runs.")
+    parser.add_argument('paths', nargs='+', help="Recorded CSV files or .npz segment directories (globs allowed)")
+    parser.add_argument('--out', default=f"report_{datetime.now():%Y%m%d_%H%M%S}.md")
+    parser.add_argument('--no-plots', action='store_true')
+    parser.add_argument('--processes', type=int)
+    args = parser.parse_args()
+
+    paths = sorted({match for pattern in args.paths for match in (glob.glob(pattern) or [pattern])})
+    write_report(paths, args.out, plots=not args.no_plots, processes=args.processes)
+    print(f"Report for {len(paths)} runs saved to {args.out}")
@@ -0,0 +1,68 @@
+import numpy as np
+
+
+# Fixed-capacity history of equally sized samples. Every sample is written twice, at i and i + capacity,
+# so the retained window is always one contiguous slice and column views never need a copy.
+class HistoryBuffer:
+    def __init__(self, capacity, columns=('time', 'level1', 'level2'), spill_path=None, spill_chunk=None):
+        self.capacity = int(capacity)
+        self.columns = tuple(columns)
+        self.index = {name: i for i, name in enumerate(self.columns)}
+        self.spill_path = spill_path
+        self.spill_chunk = max(1, int(spill_chunk or self.capacity // 10))
+        self.data = np.zeros((len(self.columns), 2 * self.capacity))
+        self.clear()
+
+    def clear(self):
+        self.start = 0
+        self.size = 0
+        self.count = 0  # samples appended since clear(), including evicted ones
+        self.spilled = 0
+        if self.spill_path:
+            open(self.spill_path, 'wb').close()
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, name):
+        return self.data[self.index[name], self.start:self.start + self.size]
+
+    @property
+    def first_index(self):
+        return self.count - self.size
+
+    def append(self, *values):
+        if self.size == self.capacity:
+            self.evict(self.spill_chunk if self.spill_path else 1)
+        position = (self.start + self.size) % self.capacity
+        self.data[:, position] = values
+        self.data[:, position + self.capacity] = values
+        self.size += 1
+        self.count += 1
+
+    def evict(self, n):
+        n = min(n, self.size)
+        if self.spill_path:
+            with open(self.spill_path, 'ab') as file:
+                # Row-major float64 samples, readable with np.fromfile(path).reshape(-1, len(columns))
+                self.data[:, self.start:self.start + n].T.tofile(file)
+            self.spilled += n
+        self.start = (self.start + n) % self.capacity
+        self.size -= n
+
+    def load(self, values, count=None):
+        # Replaces the retained window with values of shape (columns, n); count defaults to n
+        values = np.asarray(values, dtype=float)[:, -self.capacity:]
+        self.clear()
+        n = values.shape[1]
+        self.data[:, :n] = values
+        self.data[:, self.capacity:self.capacity + n] = values
+        self.size = n
+        self.count = n if count is None else max(count, n)
+
+    def read_all(self, name):
+        column = self[name]
+        if not self.spilled:
+            return column.copy()
+        spilled = np.fromfile(self.spill_path).reshape(-1, len(self.columns))[:, self.index[name]]
+        return np.concatenate([spilled, column])
@@ -0,0 +1,207 @@
+import numpy as np
+
+
+def get_state(engine):
+    return np.array([engine.level1, engine.level2, engine.integral1, engine.integral2], dtype=float)
+
+
+def set_state(engine, state):
+    maximum = (engine.tank1_max, engine.tank2_max)
+    engine.level1 = min(max(float(state[0]), 0.0), maximum[0])
+    engine.level2 = min(max(float(state[1]), 0.0), maximum[1])
+    engine.integral1 = float(state[2])
+    engine.integral2 = float(state[3])
+    engine.prev_error1 = engine.setpoint1 - engine.level1
+    engine.prev_error2 = engine.setpoint2 - engine.level2
+
+
+def derivatives(engine, state):
+    # Continuous form of the engine's PID fill and constant drain. With d(error)/dt = -(u - drain) the
+    # derivative term can be solved for directly: u * (1 + Kd) = Kp * error + Ki * integral + Kd * drain.
+    level = state[:2]
+    integral = state[2:]
+    error = np.array([engine.setpoint1, engine.setpoint2]) - level
+    maximum = np.array([engine.tank1_max, engine.tank2_max], dtype=float)
+    drain = np.zeros(2)
+    if engine.water_drain:
+        drain[0] = engine.calculate_control(level[0], *engine.thresholds1, is_draining=True)
+        drain[1] = engine.calculate_control(level[1], *engine.thresholds2, is_draining=True)
+        drain[level <= 0] = 0
+    if engine.water_flow:
+        control = np.clip((engine.Kp * error + engine.Ki * integral + engine.Kd * drain) / (1 + engine.Kd), 0, 1)
+        d_integral = error
+    else:
+        control = np.zeros(2)
+        d_integral = np.zeros(2)
+    d_level = control - drain
+    d_level[(level >= maximum) & (d_level > 0)] = 0
+    return np.concatenate([d_level, d_integral])
+
+
+def event_levels(engine):
+    # Every level something reacts to: thresholds, alarms, failsafe and tank capacity
+    return engine.thresholds.levels(0), engine.thresholds.levels(1)
+
+
+# Original explicit Euler update with the discrete PID (kept bit-for-bit identical to earlier releases)
+class EulerIntegrator:
+    adaptive = False
+
+    def advance(self, engine, time_step):
+        profiler = engine.profiler
+        if engine.water_flow:
+            if profiler is not None:
+                start = profiler.clock()
+            control1, engine.integral1, engine.prev_error1 = engine.pid_control(engine.level1, engine.setpoint1, engine.integral1, engine.prev_error1)
+            control2, engine.integral2, engine.prev_error2 = engine.pid_control(engine.level2, engine.setpoint2, engine.integral2, engine.prev_error2)
+            if profiler is not None:
+                profiler.add('pid', start)
+        if profiler is not None:
+            start = profiler.clock()
+        if engine.water_flow:
+            engine.level1 = min(engine.level1 + control1 * time_step, engine.tank1_max)
+            engine.level2 = min(engine.level2 + control2 * time_step, engine.tank2_max)
+        if engine.water_drain:
+            drain_rate1 = engine.calculate_control(engine.level1, *engine.thresholds1, is_draining=True)
+            drain_rate2 = engine.calculate_control(engine.level2, *engine.thresholds2, is_draining=True)
+            engine.level1 = max(engine.level1 - drain_rate1 * time_step, 0)
+            engine.level2 = max(engine.level2 - drain_rate2 * time_step, 0)
+        if profiler is not None:
+            profiler.add('level', start)
+
+
+class RK4Integrator:
+    adaptive = False
+
+    def advance(self, engine, time_step):
+        # PID and level are one coupled state here, so the whole update is timed as 'level'
+        profiler = engine.profiler
+        if profiler is not None:
+            start = profiler.clock()
+        y = get_state(engine)
+        k1 = derivatives(engine, y)
+        k2 = derivatives(engine, y + 0.5 * time_step * k1)
+        k3 = derivatives(engine, y + 0.5 * time_step * k2)
+        k4 = derivatives(engine, y + time_step * k3)
+        set_state(engine, y + time_step / 6 * (k1 + 2 * k2 + 2 * k3 + k4))
+        if profiler is not None:
+            profiler.add('level', start)
+
+
+# Dormand-Prince 5(4) tableau
+DP_C = np.array([0, 1 / 5, 3 / 10, 4 / 5, 8 / 9, 1, 1])
+DP_A = [
+    [],
+    [1 / 5],
+    [3 / 40, 9 / 40],
+    [44 / 45, -56 / 15, 32 / 9],
+    [19372 / 6561, -25360 / 2187, 64448 / 6561, -212 / 729],
+    [9017 / 3168, -355 / 33, 46732 / 5247, 49 / 176, -5103 / 18656],
+    [35 / 384, 0, 500 / 1113, 125 / 192, -2187 / 6784, 11 / 84],
+]
+DP_B = np.array([35 / 384, 0, 500 / 1113, 125 / 192, -2187 / 6784, 11 / 84, 0])
+DP_E = DP_B - np.array([5179 / 57600, 0, 7571 / 16695, 393 / 640, -92097 / 339200, 187 / 2100, 1 / 40])
+
+
+# Adaptive Dormand-Prince RK45. Steps grow while nothing happens and every step that would jump over a
+# threshold, alarm, failsafe or capacity level is cut short at the crossing, located by bisection on the
+# step's cubic Hermite interpolant, so crossings are published at their exact time.
+class RK45Integrator:
+    adaptive = True
+
+    def __init__(self, rtol=1e-6, atol=1e-6, max_step=60.0, first_step=0.1):
+        self.rtol = rtol
+        self.atol = atol
+        self.max_step = max_step
+        self.first_step = first_step
+        self.step_size = first_step
+        self.steps = 0
+        self.rejected = 0
+
+    def attempt(self, engine, y, f0, h):
+        stages = [f0]
+        for i in range(1, 7):
+            stages.append(derivatives(engine, y + h * sum(a * k for a, k in zip(DP_A[i], stages))))
+        k = np.array(stages)
+        y_new = y + h * DP_B @ k
+        error = h * DP_E @ k
+        scale = self.atol + self.rtol * np.maximum(np.abs(y), np.abs(y_new))
+        return y_new, stages[6], float(np.sqrt(np.mean((error / scale) ** 2)))
+
+    def find_events(self, engine, y0, f0, y1, f1, h):
+        events = []
+        for tank, levels in enumerate(event_levels(engine)):
+            start, end = y0[tank], y1[tank]
+            for level in levels:
+                rising = start < level <= end
+                falling = start >= level > end
+                if not (rising or falling):
+                    continue
+                low, high = 0.0, 1.0
+                for _ in range(50):
+                    middle = 0.5 * (low + high)
+                    value = hermite(y0[tank], f0[tank], y1[tank], f1[tank], h, middle)
+                    if (value >= level) == rising:
+                        high = middle
+                    else:
+                        low = middle
+                events.append((high * h, tank, level, rising))
+        return sorted(events)
+
+    def integrate(self, engine, end_time):
+        t = engine.time
+        y = get_state(engine)
+        f0 = derivatives(engine, y)
+        h = self.step_size
+        while end_time - t > 1e-12:
+            h_try = min(h, self.max_step, end_time - t)
+            y_new, f_new, error = self.attempt(engine, y, f0, h_try)
+            if error > 1:
+                self.rejected += 1
+                h = h_try * max(0.2, 0.9 * error ** -0.2)
+                continue
+
+            taken = h_try
+            events = self.find_events(engine, y, f0, y_new, f_new, h_try)
+            if events:
+                taken = events[0][0]
+                if taken <= 1e-12:
+                    # Already sitting on the level: snap onto the right side of it and retry from here
+                    _, tank, level, rising = events[0]
+                    y[tank] = level if rising else np.nextafter(level, -np.inf)
+                    f0 = derivatives(engine, y)
+                    continue
+                fraction = taken / h_try
+                y_new = np.array([hermite(y[i], f0[i], y_new[i], f_new[i], h_try, fraction) for i in range(len(y))])
+                # Land exactly on every crossing that happens at this instant, so the published sample is on
+                # the right side of each of them
+                for when, tank, level, rising in events:
+                    if when - taken <= 1e-9:
+                        y_new[tank] = level if rising else np.nextafter(level, -np.inf)
+                f_new = derivatives(engine, y_new)
+
+            t = end_time if end_time - (t + taken) <= 1e-12 else t + taken
+            y = y_new
+            f0 = f_new
+            set_state(engine, y)
+            y = get_state(engine)
+            self.steps += 1
+            engine.tick += 1
+            engine.time = t
+            engine.publish()
+            if taken == h_try:
+                # A step shortened only to land on end_time says nothing about the next step size
+                h = max(h, h_try * min(5.0, 0.9 * max(error, 1e-10) ** -0.2))
+            self.step_size = h
+
+
+def hermite(y0, f0, y1, f1, h, s):
+    return ((2 * s ** 3 - 3 * s ** 2 + 1) * y0 + (s ** 3 - 2 * s ** 2 + s) * h * f0
+            + (-2 * s ** 3 + 3 * s ** 2) * y1 + (s ** 3 - s ** 2) * h * f1)
+
+
+INTEGRATORS = {
+    'euler': EulerIntegrator,
+    'rk4': RK4Integrator,
+    'rk45': RK45Integrator,
+}
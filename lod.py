@@ -0,0 +1,109 @@
+import numpy as np
+
+from history import HistoryBuffer
+
+
+# Min/max level-of-detail pyramid over a HistoryBuffer whose first column is time. Level k holds one
+# (start time, min, max) bucket per factor**k raw samples, so a query only ever touches about as many
+# buckets as the plot has pixels while keeping every peak and trough visible.
+class MinMaxPyramid:
+    def __init__(self, history, factor=4):
+        self.history = history
+        self.factor = factor
+        self.channels = history.columns[1:]
+        columns = ('time',) + tuple(f'min_{name}' for name in self.channels) + tuple(f'max_{name}' for name in self.channels)
+        self.levels = []
+        bucket = factor
+        while bucket <= history.capacity:
+            self.levels.append(HistoryBuffer(history.capacity // bucket + 2, columns=columns))
+            bucket *= factor
+
+    def clear(self):
+        for level in self.levels:
+            level.clear()
+
+    def sync(self):
+        n_channels = len(self.channels)
+        source = self.history
+        for level in self.levels:
+            if source.count < level.count * self.factor:
+                # Source was cleared since the last sync
+                self.clear()
+            first = -(-source.first_index // self.factor)
+            if level.count < first:
+                # Samples were evicted before they could be bucketed; restart this level after the gap
+                level.clear()
+                level.count = first
+            last = source.count // self.factor
+            if last > level.count:
+                start = level.count * self.factor - source.first_index
+                stop = last * self.factor - source.first_index
+                window = source.data[:, source.start + start:source.start + stop].reshape(len(source.columns), -1, self.factor)
+                times = window[0, :, 0]
+                if source is self.history:
+                    mins = window[1:].min(axis=2)
+                    maxs = window[1:].max(axis=2)
+                else:
+                    mins = window[1:1 + n_channels].min(axis=2)
+                    maxs = window[1 + n_channels:].max(axis=2)
+                for i in range(len(times)):
+                    level.append(times[i], *mins[:, i], *maxs[:, i])
+            source = level
+
+    def query(self, x0=-np.inf, x1=np.inf, max_points=1000):
+        self.sync()
+        history = self.history
+        times = history['time']
+        start = max(int(np.searchsorted(times, x0)) - 1, 0)
+        stop = min(int(np.searchsorted(times, x1, side='right')) + 1, len(times))
+        n = stop - start
+        if n <= max_points:
+            return times[start:stop], [history[name][start:stop] for name in self.channels]
+
+        # Two points (min and max) per bucket
+        for k, level in enumerate(self.levels, 1):
+            bucket = self.factor ** k
+            if n / bucket <= max_points / 2:
+                break
+
+        first = max(-(-(history.first_index + start) // bucket), level.first_index)
+        last = min((history.first_index + stop) // bucket, level.count)
+        lo = first - level.first_index
+        hi = max(last - level.first_index, lo)
+        bucket_times = level['time'][lo:hi]
+        n_channels = len(self.channels)
+        xs, ys = [], [[] for _ in range(n_channels)]
+
+        def add_raw(begin, end):
+            # Samples outside the complete buckets of this level are decimated on the fly
+            if begin < end:
+                x_raw, y_raw = minmax_decimate(times[begin:end], [history[name][begin:end] for name in self.channels],
+                                               bucket)
+                xs.append(x_raw)
+                for c in range(n_channels):
+                    ys[c].append(y_raw[c])
+
+        # Samples from the window start up to the first complete bucket, the buckets, then the samples after them
+        head_stop = min(max(first * bucket - history.first_index, start), stop)
+        add_raw(start, head_stop)
+        xs.append(np.repeat(bucket_times, 2))
+        for c in range(n_channels):
+            ys[c].append(np.column_stack((level[level.columns[1 + c]][lo:hi],
+                                          level[level.columns[1 + n_channels + c]][lo:hi])).ravel())
+        tail = max(last * bucket - history.first_index, head_stop)
+        if tail == stop and hi > lo:
+            # Buckets are drawn at their start times, so the newest sample is added to reach the window's end
+            tail = stop - 1
+        add_raw(tail, stop)
+        return np.concatenate(xs), [np.concatenate(parts) for parts in ys]
+
+
+def minmax_decimate(x, ys, bucket):
+    if bucket <= 1 or len(x) <= 2:
+        return x, ys
+    starts = np.arange(0, len(x), bucket)
+    # The newest raw sample is kept so the live edge of the curve does not lag behind
+    x_out = np.append(np.repeat(x[starts], 2), x[-1])
+    ys_out = [np.append(np.column_stack((np.minimum.reduceat(y, starts), np.maximum.reduceat(y, starts))).ravel(), y[-1])
+              for y in ys]
+    return x_out, ys_out
@@ -0,0 +1,351 @@
+import argparse
+import asyncio
+import logging
+import struct
+import threading
+import time as wall_time
+
+import numpy as np
+
+from scenario import ACTIONS
+
+MBAP = struct.Struct('>HHHB')  # transaction id, protocol id (0), byte count of unit id + PDU, unit id
+READ_HOLDING, READ_INPUT, WRITE_SINGLE, WRITE_MULTIPLE, READ_WRITE_MULTIPLE = 3, 4, 6, 16, 23
+ILLEGAL_FUNCTION, ILLEGAL_ADDRESS, ILLEGAL_VALUE = 1, 2, 3
+MAX_READ, MAX_WRITE = 125, 121
+
+# (name, scale) of each register, in address order; a register holds round(value * scale) as an unsigned 16-bit int
+INPUT_REGISTERS = (('level1', 100), ('level2', 100), ('status', 1), ('alarm_level', 1),
+                   ('tick_high', 1), ('tick_low', 1), ('time_ms_high', 1), ('time_ms_low', 1))
+HOLDING_REGISTERS = (('commands', 1), ('setpoint1', 100), ('setpoint2', 100), ('Kp', 1000), ('Ki', 1000), ('Kd', 1000))
+# Bits of the status input register
+STATUS_BITS = ('power_on', 'sensor_working', 'water_flow', 'water_drain', 'failsafe', 'overflow')
+# Bits of the commands holding register: (engine flag, scenario action when set, action when cleared)
+COMMAND_BITS = (('water_flow', 'start_water_flow', 'stop_water_flow'),
+                ('water_drain', 'start_water_drain', 'stop_water_drain'),
+                ('power_on', 'power_restore', 'power_loss'),
+                ('sensor_working', 'sensor_restore', 'sensor_failure'))
+
+
+class ModbusError(Exception):
+    def __init__(self, code, message=None):
+        super().__init__(message or f"Modbus exception {code}")
+        self.code = code
+
+
+def encode(value, scale):
+    return min(max(int(round(value * scale)), 0), 0xFFFF)
+
+
+# Modbus TCP server exposing an engine as registers, for running real PLC logic against the simulation.
+# Function codes 3 and 4 read holding and input registers, 6 and 16 write holding registers and 23 writes
+# and reads in one round trip. Input registers are served from a snapshot the engine subscriber takes every
+# step, so a multi-register read is always consistent and never waits for the simulation; writes are applied
+# between steps under the worker's lock. Any number of clients can connect and pipeline requests.
+class ModbusServer:
+    def __init__(self, host='127.0.0.1', port=5020, logger=None):
+        self.host = host
+        self.port = port
+        self.logger = logger if logger is not None else logging.getLogger('TankSimulation')
+        self.engine = None
+        self.lock = None
+        self.snapshot = None
+        self.requests = 0
+        self.clients = 0
+        self.thread = None
+        self.loop = None
+        self.stopping = None
+        self.error = None
+
+    def attach(self, engine, lock=None):
+        # lock is the SimulationWorker's lock when a worker steps the engine
+        self.engine = engine
+        self.lock = lock if lock is not None else threading.RLock()
+        engine.subscribe(self.on_engine_update)
+        self.on_engine_update(engine, None)
+
+    def detach(self, engine):
+        engine.unsubscribe(self.on_engine_update)
+
+    def on_engine_update(self, engine, status):
+        self.snapshot = (engine.tick, engine.time, engine.level1, engine.level2, engine.alarm_level or 0,
+                         engine.power_on, engine.sensor_working, engine.water_flow, engine.water_drain)
+
+    def input_registers(self):
+        tick, time, level1, level2, alarm_level, *flags = self.snapshot
+        engine = self.engine
+        flags += [max(level1, level2) >= engine.failsafe_level,
+                  level1 >= engine.tank1_max or level2 >= engine.tank2_max]
+        status = sum(bool(flag) << bit for bit, flag in enumerate(flags))
+        tick &= 0xFFFFFFFF
+        time_ms = int(time * 1000) & 0xFFFFFFFF
+        return [encode(level1, 100), encode(level2, 100), status, alarm_level,
+                tick >> 16, tick & 0xFFFF, time_ms >> 16, time_ms & 0xFFFF]
+
+    def holding_registers(self):
+        engine = self.engine
+        commands = sum(bool(getattr(engine, flag)) << bit for bit, (flag, _, _) in enumerate(COMMAND_BITS))
+        return [commands] + [encode(getattr(engine, name), scale) for name, scale in HOLDING_REGISTERS[1:]]
+
+    def read(self, function, start, count):
+        if not 1 <= count <= MAX_READ:
+            raise ModbusError(ILLEGAL_VALUE)
+        registers = self.input_registers() if function == READ_INPUT else self.holding_registers()
+        if start + count > len(registers):
+            raise ModbusError(ILLEGAL_ADDRESS)
+        return registers[start:start + count]
+
+    def write(self, start, values):
+        if not 1 <= len(values) <= MAX_WRITE:
+            raise ModbusError(ILLEGAL_VALUE)
+        if start + len(values) > len(HOLDING_REGISTERS):
+            raise ModbusError(ILLEGAL_ADDRESS)
+        engine = self.engine
+        with self.lock:
+            for (name, scale), value in zip(HOLDING_REGISTERS[start:], values):
+                if name != 'commands':
+                    setattr(engine, name, value / scale)
+                    continue
+                for bit, (flag, set_action, clear_action) in enumerate(COMMAND_BITS):
+                    on = bool(value >> bit & 1)
+                    if bool(getattr(engine, flag)) != on:
+                        ACTIONS[set_action if on else clear_action](engine)
+
+    def process(self, pdu):
+        # One request PDU -> one response PDU; failures become Modbus exception responses
+        function = pdu[0]
+        try:
+            if function in (READ_HOLDING, READ_INPUT):
+                start, count = struct.unpack_from('>HH', pdu, 1)
+                values = self.read(function, start, count)
+                return struct.pack(f'>BB{count}H', function, 2 * count, *values)
+            if function == WRITE_SINGLE:
+                address, value = struct.unpack_from('>HH', pdu, 1)
+                self.write(address, [value])
+                return bytes(pdu[:5])
+            if function == WRITE_MULTIPLE:
+                start, count, size = struct.unpack_from('>HHB', pdu, 1)
+                if size != 2 * count:
+                    raise ModbusError(ILLEGAL_VALUE)
+                self.write(start, struct.unpack_from(f'>{count}H', pdu, 6))
+                return bytes(pdu[:5])
+            if function == READ_WRITE_MULTIPLE:
+                read_start, read_count, write_start, write_count, size = struct.unpack_from('>HHHHB', pdu, 1)
+                if size != 2 * write_count:
+                    raise ModbusError(ILLEGAL_VALUE)
+                self.write(write_start, struct.unpack_from(f'>{write_count}H', pdu, 10))
+                values = self.read(READ_HOLDING, read_start, read_count)
+                return struct.pack(f'>BB{read_count}H', function, 2 * read_count, *values)
+            raise ModbusError(ILLEGAL_FUNCTION)
+        except ModbusError as error:
+            return bytes((function | 0x80, error.code))
+        except struct.error:
+            return bytes((function | 0x80, ILLEGAL_VALUE))
+
+    def start(self):
+        ready = threading.Event()
+        self.thread = threading.Thread(target=asyncio.run, args=(self._serve(ready),), name='Modbus', daemon=True)
+        self.thread.start()
+        ready.wait()
+        if self.error is not None:
+            raise self.error
+        return self.port
+
+    def stop(self):
+        if self.thread is None:
+            return
+        if self.loop is not None and self.loop.is_running():
+            self.loop.call_soon_threadsafe(self.stopping.set)
+        self.thread.join()
+        self.thread = None
+
+    async def _serve(self, ready):
+        self.loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        try:
+            server = await asyncio.start_server(self._handle, self.host, self.port)
+        except OSError as error:
+            self.error = error
+            ready.set()
+            return
+        self.port = server.sockets[0].getsockname()[1]
+        ready.set()
+        self.logger.info(f"Modbus TCP server on {self.host}:{self.port}", extra={'event': 'modbus_started'})
+        await self.stopping.wait()
+        server.close()
+
+    async def _handle(self, reader, writer):
+        self.clients += 1
+        peer = writer.get_extra_info('peername')
+        self.logger.info(f"Modbus client {peer} connected", extra={'event': 'modbus_connected'})
+        try:
+            while True:
+                transaction, protocol, length, unit = MBAP.unpack(await reader.readexactly(MBAP.size))
+                if protocol != 0 or not 2 <= length <= 254:
+                    break
+                response = self.process(await reader.readexactly(length - 1))
+                self.requests += 1
+                writer.write(MBAP.pack(transaction, protocol, len(response) + 1, unit) + response)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, OSError):
+            pass
+        finally:
+            self.clients -= 1
+            writer.close()
+            self.logger.info(f"Modbus client {peer} disconnected", extra={'event': 'modbus_disconnected'})
+
+
+# Minimal asyncio Modbus TCP client with one request in flight at a time
+class ModbusClient:
+    def __init__(self, host='127.0.0.1', port=5020, unit=1):
+        self.host = host
+        self.port = port
+        self.unit = unit
+        self.transaction = 0
+        self.reader = None
+        self.writer = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        return self
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            await self.writer.wait_closed()
+            self.writer = None
+
+    async def request(self, pdu):
+        self.transaction = (self.transaction + 1) & 0xFFFF
+        self.writer.write(MBAP.pack(self.transaction, 0, len(pdu) + 1, self.unit) + pdu)
+        transaction, _, length, _ = MBAP.unpack(await self.reader.readexactly(MBAP.size))
+        response = await self.reader.readexactly(length - 1)
+        if transaction != self.transaction:
+            raise ModbusError(0, f"Response to transaction {transaction}, expected {self.transaction}")
+        if response[0] & 0x80:
+            raise ModbusError(response[1])
+        return response
+
+    async def read_registers(self, function, start, count):
+        response = await self.request(struct.pack('>BHH', function, start, count))
+        return list(struct.unpack_from(f'>{count}H', response, 2))
+
+    async def read_input_registers(self, start, count):
+        return await self.read_registers(READ_INPUT, start, count)
+
+    async def read_holding_registers(self, start, count):
+        return await self.read_registers(READ_HOLDING, start, count)
+
+    async def write_register(self, address, value):
+        await self.request(struct.pack('>BHH', WRITE_SINGLE, address, value))
+
+    async def write_registers(self, start, values):
+        await self.request(struct.pack(f'>BHHB{len(values)}H', WRITE_MULTIPLE, start, len(values), 2 * len(values),
+                                        *values))
+
+    async def read_write_registers(self, read_start, read_count, write_start, values):
+        response = await self.request(struct.pack(f'>BHHHHB{len(values)}H', READ_WRITE_MULTIPLE, read_start,
+                                                  read_count, write_start, len(values), 2 * len(values), *values))
+        return list(struct.unpack_from(f'>{read_count}H', response, 2))
+
+
+# Stand-in for the PLC program under test: every scan reads all input registers in one request and runs a
+# two-point controller on tank 1 (fill below low, drain above high), writing the command word only when it
+# changes. run() returns scan statistics, so it doubles as a latency check of the loopback.
+class SoftPLC:
+    def __init__(self, client, scan_time=0.01, low=40.0, high=60.0):
+        self.client = client
+        self.scan_time = scan_time
+        self.low = low
+        self.high = high
+        self.commands = None
+
+    def logic(self, inputs):
+        level1 = inputs[0] / 100.0
+        commands = self.commands
+        if level1 < self.low:
+            commands = (commands & ~0b10) | 0b01
+        elif level1 > self.high:
+            commands = (commands & ~0b01) | 0b10
+        return commands
+
+    async def run(self, duration):
+        client = self.client
+        self.commands, = await client.read_holding_registers(0, 1)
+        loop = asyncio.get_running_loop()
+        latencies, overruns, writes = [], 0, 0
+        started = next_scan = loop.time()
+        while loop.time() - started < duration:
+            scan_started = wall_time.perf_counter()
+            inputs = await client.read_input_registers(0, len(INPUT_REGISTERS))
+            commands = self.logic(inputs)
+            if commands != self.commands:
+                await client.write_register(0, commands)
+                self.commands = commands
+                writes += 1
+            latencies.append(wall_time.perf_counter() - scan_started)
+            next_scan += self.scan_time
+            delay = next_scan - loop.time()
+            if delay < 0:
+                overruns += 1
+                next_scan = loop.time()
+            await asyncio.sleep(max(delay, 0))
+        latencies = np.array(latencies) * 1000
+        return {'scans': len(latencies), 'overruns': overruns, 'command_writes': writes,
+                'scan_ms_p50': float(np.percentile(latencies, 50)), 'scan_ms_p99': float(np.percentile(latencies, 99)),
+                'scan_ms_max': float(latencies.max())}
+
+
+async def run_plcs(host, port, n, duration, scan_time):
+    clients = [await ModbusClient(host, port).connect() for _ in range(n)]
+    try:
+        return await asyncio.gather(*(SoftPLC(client, scan_time).run(duration) for client in clients))
+    finally:
+        for client in clients:
+            await client.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Modbus TCP interface to the engine: 'serve' a simulation, run soft-PLC clients against one "
+                    "('plc'), or both in one process ('loopback').")
+    parser.add_argument('mode', choices=['serve', 'plc', 'loopback'])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5020)
+    parser.add_argument('--time-step', type=float, default=0.01, help="Engine step; should not exceed the scan time")
+    parser.add_argument('--speed', type=float, default=1.0)
+    parser.add_argument('--scan-time', type=float, default=0.01)
+    parser.add_argument('--clients', type=int, default=1, help="Concurrent soft PLCs")
+    parser.add_argument('--duration', type=float, default=10, help="Wall seconds of soft-PLC scanning")
+    args = parser.parse_args()
+
+    worker = server = None
+    if args.mode in ('serve', 'loopback'):
+        from simulation_worker import SimulationWorker
+        from tank_engine import TankEngine
+
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+        engine = TankEngine(time_step=args.time_step, record_history=False)
+        worker = SimulationWorker(engine, speed=args.speed)
+        server = ModbusServer(args.host, 0 if args.mode == 'loopback' else args.port)
+        server.attach(engine, worker.lock)
+        port = server.start()
+        worker.start()
+    else:
+        port = args.port
+
+    try:
+        if args.mode == 'serve':
+            while True:
+                wall_time.sleep(1.0)
+        for index, stats in enumerate(asyncio.run(run_plcs(args.host, port, args.clients, args.duration,
+                                                            args.scan_time))):
+            print(f"PLC {index + 1}: {stats['scans']} scans, {stats['overruns']} overruns, "
+                  f"{stats['command_writes']} command writes, scan p50 {stats['scan_ms_p50']:.3f} ms, "
+                  f"p99 {stats['scan_ms_p99']:.3f} ms, max {stats['scan_ms_max']:.3f} ms")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if worker is not None:
+            worker.stop()
+            server.stop()
@@ -0,0 +1,82 @@
+import json
+import threading
+import time as wall_time
+
+import numpy as np
+
+
+# Running statistics for one phase plus a ring of the most recent durations for percentiles
+class PhaseStats:
+    def __init__(self, window):
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        self.recent = [0] * window
+        self.window = window
+
+    def add(self, elapsed_ns):
+        self.recent[self.count % self.window] = elapsed_ns
+        self.count += 1
+        self.total_ns += elapsed_ns
+        if elapsed_ns > self.max_ns:
+            self.max_ns = elapsed_ns
+
+    def summary(self):
+        recent = np.array(self.recent[:min(self.count, self.window)], dtype=float) / 1000.0
+        return {
+            'count': self.count,
+            'total_ms': self.total_ns / 1e6,
+            'mean_us': self.total_ns / self.count / 1000.0 if self.count else 0.0,
+            'p50_us': float(np.percentile(recent, 50)) if len(recent) else 0.0,
+            'p99_us': float(np.percentile(recent, 99)) if len(recent) else 0.0,
+            'max_us': self.max_ns / 1000.0,
+        }
+
+
+# Opt-in timers and counters for the phases of a tick. Code on the hot path keeps a reference that is None
+# when profiling is off, so the only cost then is one comparison per phase:
+#
+#     if profiler is not None:
+#         start = profiler.clock()
+#     ...
+#     if profiler is not None:
+#         profiler.add('pid', start)
+#
+# Phases are recorded inclusively: 'step' contains 'pid', 'level', 'thresholds' and 'subscribers', and
+# 'thresholds' contains the 'logging' and 'alarms' callbacks it triggers. Writes come from the simulation
+# and GUI threads without locking; readers get a consistent enough picture for a live display.
+class Profiler:
+    clock = staticmethod(wall_time.perf_counter_ns)
+
+    def __init__(self, window=2048):
+        self.window = window
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.phases = {}
+        self.counters = {}
+        self.started = wall_time.perf_counter()
+
+    def add(self, name, start):
+        elapsed = wall_time.perf_counter_ns() - start
+        phase = self.phases.get(name)
+        if phase is None:
+            with self.lock:
+                phase = self.phases.setdefault(name, PhaseStats(self.window))
+        phase.add(elapsed)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def snapshot(self, **extra):
+        return {
+            'elapsed_s': wall_time.perf_counter() - self.started,
+            'phases': {name: phase.summary() for name, phase in list(self.phases.items())},
+            'counters': dict(self.counters),
+            **extra,
+        }
+
+    def dump(self, path, **extra):
+        with open(path, 'w') as file:
+            json.dump(self.snapshot(**extra), file, indent=2)
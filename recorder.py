@@ -0,0 +1,120 @@
+import csv
+import json
+import os
+import queue
+import threading
+import time as wall_time
+
+import numpy as np
+
+CSV_HEADER = ['Tick', 'Time', 'Tank1 Level', 'Tank2 Level']
+
+
+# Streams samples to disk while the simulation runs. Samples are collected into preallocated chunks that
+# a background thread writes out whenever a chunk fills up or flush_interval seconds have passed, so a
+# crash loses at most one chunk and stopping never has to dump the whole run at once.
+#
+# format='csv' writes one CSV file; format='npz' treats path as a directory of float32 .npz segments
+# plus a meta.json. Every sample carries its integer tick index next to the simulated time, which is
+# rounded to drop float noise (and is not tick * time_step when an adaptive integrator is used).
+class RunRecorder:
+    def __init__(self, path, format='csv', time_step=0.1, chunk_size=4096, flush_interval=1.0,
+                 columns=('level1', 'level2')):
+        if format not in ('csv', 'npz'):
+            raise ValueError(f"Unknown recording format: {format}")
+        self.path = path
+        self.format = format
+        self.time_step = time_step
+        self.chunk_size = chunk_size
+        self.flush_interval = flush_interval
+        self.columns = tuple(columns)
+        self.samples = 0
+        self.last_tick = None
+        self.error = None
+        self.queue = queue.Queue()
+        self._new_chunk()
+        self.last_flush = wall_time.monotonic()
+        self.thread = threading.Thread(target=self._write_loop, name='RunRecorder', daemon=True)
+        self.thread.start()
+
+    def _new_chunk(self):
+        self.ticks = np.empty(self.chunk_size, dtype=np.int64)
+        self.times = np.empty(self.chunk_size)
+        self.values = np.empty((len(self.columns), self.chunk_size))
+        self.fill = 0
+
+    def attach(self, engine):
+        # The state at attach time is the first sample of the run
+        self.last_tick = engine.tick
+        self.record(engine.tick, engine.time, engine.level1, engine.level2)
+        engine.subscribe(self.on_engine_update)
+
+    def detach(self, engine):
+        engine.unsubscribe(self.on_engine_update)
+
+    def on_engine_update(self, engine, status):
+        # Status-only notifications (buttons, power off) do not advance the tick
+        if engine.tick != self.last_tick:
+            self.last_tick = engine.tick
+            self.record(engine.tick, engine.time, engine.level1, engine.level2)
+
+    def record(self, tick, time, *values):
+        self.ticks[self.fill] = tick
+        self.times[self.fill] = time
+        self.values[:, self.fill] = values
+        self.fill += 1
+        self.samples += 1
+        if self.fill == self.chunk_size or wall_time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if self.fill:
+            self.queue.put((self.ticks[:self.fill], self.times[:self.fill], self.values[:, :self.fill]))
+            self._new_chunk()
+        self.last_flush = wall_time.monotonic()
+
+    def close(self):
+        self.flush()
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def _write_loop(self):
+        try:
+            if self.format == 'csv':
+                self._write_csv()
+            else:
+                self._write_npz()
+        except Exception as error:  # surfaced to the caller on close()
+            self.error = error
+            while self.queue.get() is not None:
+                pass
+
+    def _write_csv(self):
+        with open(self.path, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(CSV_HEADER[:2] + CSV_HEADER[2:2 + len(self.columns)])
+            file.flush()
+            while True:
+                chunk = self.queue.get()
+                if chunk is None:
+                    break
+                ticks, times, values = chunk
+                times = np.round(times, 9)
+                writer.writerows(zip(ticks.tolist(), times.tolist(), *values.tolist()))
+                file.flush()
+
+    def _write_npz(self):
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, 'meta.json'), 'w') as file:
+            json.dump({'time_step': self.time_step, 'columns': list(self.columns)}, file)
+        segment = 0
+        while True:
+            chunk = self.queue.get()
+            if chunk is None:
+                break
+            ticks, times, values = chunk
+            arrays = {name: column.astype(np.float32) for name, column in zip(self.columns, values)}
+            np.savez(os.path.join(self.path, f'segment_{segment:05d}.npz'), tick=ticks, time=times, **arrays)
+            segment += 1
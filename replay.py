@@ -0,0 +1,51 @@
+import numpy as np
+
+from run_analysis import load_run
+
+MAX_SAMPLES_PER_ADVANCE = 5000
+
+
+# Plays a recorded run back through a TankEngine, so the viewer's plot, status, alarm and logging paths see
+# exactly what they would see live. Samples are read from the memory-mapped run a slice at a time.
+class RunReplay:
+    def __init__(self, engine, path, speed=1.0):
+        self.engine = engine
+        self.run = load_run(path)
+        self.speed = speed  # float('inf') plays as fast as possible
+        self.position = 0
+        self.start_time = float(self.run.time[0]) if len(self.run) else 0.0
+        self.end_time = float(self.run.time[-1]) if len(self.run) else 0.0
+        self.clock = self.start_time
+
+    @property
+    def finished(self):
+        return self.position >= len(self.run)
+
+    def seek(self, time):
+        time = min(max(time, self.start_time), self.end_time)
+        self.position = int(np.searchsorted(self.run.time, time))
+        self.clock = time
+        # Start the viewer's history over and make the next sample its own baseline for threshold logging
+        engine = self.engine
+        engine.history.clear()
+        previous = self.run.data[:, max(self.position - 1, 0)]
+        engine.thresholds.reset(previous[1:3])
+
+    def advance(self, wall_seconds):
+        if self.finished:
+            return 0
+        if self.speed == float('inf'):
+            end = self.position + MAX_SAMPLES_PER_ADVANCE
+        else:
+            self.clock += wall_seconds * self.speed
+            end = int(np.searchsorted(self.run.time, self.clock, side='right'))
+        end = min(end, self.position + MAX_SAMPLES_PER_ADVANCE, len(self.run))
+
+        samples = self.run.data[:, self.position:end].tolist()
+        for offset, (time, level1, level2) in enumerate(zip(*samples)):
+            self.engine.load_sample(self.position + offset, time, level1, level2)
+        count = end - self.position
+        self.position = end
+        if self.speed == float('inf') and count:
+            self.clock = samples[0][-1]
+        return count
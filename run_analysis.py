@@ -0,0 +1,188 @@
+import argparse
+import csv
+import glob
+import json
+import os
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+CACHE_DIR = '.run_cache'
+CROSSING_LEVELS = (20, 30, 80, 90, 95, 98)
+TIME_ABOVE_LEVELS = (90, 95, 98)
+CONVERT_CHUNK_ROWS = 65536
+
+
+# A recorded run served as zero-copy views into a memory-mapped (3, n) float64 array of time, level1, level2
+class Run:
+    def __init__(self, path, data):
+        self.path = path
+        self.data = data
+        self.time = data[0]
+        self.level1 = data[1]
+        self.level2 = data[2]
+
+    def __len__(self):
+        return self.data.shape[1]
+
+    @property
+    def levels(self):
+        return self.data[1:]
+
+
+def cache_path(path):
+    directory, name = os.path.split(os.path.abspath(path.rstrip('/\\')))
+    return os.path.join(directory, CACHE_DIR, name + '.npy')
+
+
+def _source_mtime(path):
+    if os.path.isdir(path):
+        return max(os.path.getmtime(name) for name in glob.glob(os.path.join(path, '*')))
+    return os.path.getmtime(path)
+
+
+def _read_csv_chunks(path):
+    with open(path, newline='') as file:
+        header = next(csv.reader([file.readline()]))
+        columns = [name.strip() for name in header]
+        if 'Tick' in columns:
+            wanted = [columns.index('Time'), columns.index('Tank1 Level'), columns.index('Tank2 Level')]
+        else:
+            wanted = [0, 1, 2]
+        while True:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', UserWarning)  # loadtxt warns when it reaches end of file
+                chunk = np.loadtxt(file, delimiter=',', usecols=wanted, max_rows=CONVERT_CHUNK_ROWS, ndmin=2)
+            if not len(chunk):
+                break
+            yield chunk.T
+
+
+def _read_npz_chunks(path):
+    with open(os.path.join(path, 'meta.json')) as file:
+        meta = json.load(file)
+    for name in sorted(glob.glob(os.path.join(path, 'segment_*.npz'))):
+        with np.load(name) as segment:
+            if 'time' in segment.files:
+                time = segment['time']
+            else:
+                time = np.round(segment['tick'] * meta['time_step'], 9)
+            yield np.vstack([time] + [segment[column] for column in meta['columns'][:2]])
+
+
+def convert_run(path, force=False):
+    target = cache_path(path)
+    if not force and os.path.exists(target) and os.path.getmtime(target) >= _source_mtime(path):
+        return target
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    chunks = _read_npz_chunks(path) if os.path.isdir(path) else _read_csv_chunks(path)
+
+    # Stream the text into a growing temporary buffer once, then lay it out column-major for memory mapping
+    temporary = target + '.tmp'
+    rows = 0
+    with open(temporary, 'wb') as file:
+        for chunk in chunks:
+            np.ascontiguousarray(chunk.T, dtype=np.float64).tofile(file)
+            rows += chunk.shape[1]
+    samples = np.memmap(temporary, dtype=np.float64, mode='r', shape=(rows, 3)) if rows else np.empty((0, 3))
+    output = np.lib.format.open_memmap(target + '.part', mode='w+', dtype=np.float64, shape=(3, rows))
+    for start in range(0, rows, CONVERT_CHUNK_ROWS):
+        output[:, start:start + CONVERT_CHUNK_ROWS] = samples[start:start + CONVERT_CHUNK_ROWS].T
+    output.flush()
+    del output, samples
+    os.remove(temporary)
+    os.replace(target + '.part', target)
+    return target
+
+
+def load_run(path):
+    return Run(path, np.load(convert_run(path), mmap_mode='r'))
+
+
+def load_runs(paths):
+    return [load_run(path) for path in paths]
+
+
+def threshold_crossings(time, level, threshold):
+    # Rising crossings, with the time linearly interpolated between the two samples around the crossing
+    index = np.flatnonzero((level[1:] >= threshold) & (level[:-1] < threshold)) + 1
+    before, after = level[index - 1], level[index]
+    fraction = (threshold - before) / (after - before)
+    return time[index - 1] + fraction * (time[index] - time[index - 1])
+
+
+def time_above(time, levels, thresholds):
+    # levels may be (n,) or (tanks, n); returns (len(thresholds),) or (tanks, len(thresholds))
+    dt = np.diff(time, append=time[-1]) if len(time) else time
+    above = np.asarray(levels)[..., None, :] >= np.asarray(thresholds, dtype=float)[:, None]
+    return (above * dt).sum(axis=-1)
+
+
+def fill_rate_stats(time, levels):
+    dt = np.diff(time)
+    rates = np.diff(levels, axis=-1) / np.where(dt > 0, dt, np.nan)
+    filling = np.where(rates > 0, rates, np.nan)
+    draining = np.where(rates < 0, rates, np.nan)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # tanks that never filled or drained give NaN
+        return {
+            'mean_fill_rate': np.nanmean(filling, axis=-1),
+            'max_fill_rate': np.nanmax(np.nan_to_num(filling, nan=0.0), axis=-1),
+            'mean_drain_rate': np.nanmean(draining, axis=-1),
+        }
+
+
+def analyze_run(path, crossing_levels=CROSSING_LEVELS, time_above_levels=TIME_ABOVE_LEVELS):
+    run = load_run(path)
+    rows = []
+    if not len(run):
+        return rows
+    above = time_above(run.time, run.levels, time_above_levels)
+    rates = fill_rate_stats(run.time, run.levels)
+    for tank, level in enumerate(run.levels):
+        row = {'file': path, 'tank': tank + 1, 'samples': len(run), 'duration': float(run.time[-1] - run.time[0]),
+               'max_level': float(level.max())}
+        for threshold in crossing_levels:
+            crossings = threshold_crossings(run.time, level, threshold)
+            row[f'first_{threshold}'] = float(crossings[0]) if len(crossings) else float('nan')
+        for threshold, seconds in zip(time_above_levels, above[tank]):
+            row[f'time_above_{threshold}'] = float(seconds)
+        for name, values in rates.items():
+            row[name] = float(values[tank])
+        rows.append(row)
+    return rows
+
+
+def analyze_runs(paths, processes=None):
+    if processes == 1 or len(paths) < 2:
+        results = map(analyze_run, paths)
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            results = list(pool.map(analyze_run, paths))
+    return [row for rows in results for row in rows]
+
+
+def write_table(rows, filename):
+    with open(filename, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Convert recorded runs to memory-mapped arrays and analyze them.")
+    parser.add_argument('paths', nargs='+', help="Recorded CSV files or .npz segment directories (globs allowed)")
+    parser.add_argument('--out', help="Write the per-run, per-tank table to this CSV file")
+    parser.add_argument('--processes', type=int)
+    args = parser.parse_args()
+
+    paths = sorted({match for pattern in args.paths for match in (glob.glob(pattern) or [pattern])})
+    rows = analyze_runs(paths, args.processes)
+    if args.out:
+        write_table(rows, args.out)
+        print(f"Analyzed {len(paths)} runs. Results saved to {args.out}")
+    else:
+        for row in rows:
+            print(', '.join(f"{key}={value:.2f}" if isinstance(value, float) else f"{key}={value}"
+                            for key, value in row.items()))
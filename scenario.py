@@ -0,0 +1,212 @@
+import argparse
+import csv
+import glob
+import heapq
+import json
+import logging
+import math
+import os
+import sys
+import time as wall_time
+from concurrent.futures import ProcessPoolExecutor
+
+from integrators import INTEGRATORS
+from tank_engine import TankEngine
+
+# Engine attributes a scenario may set before the run starts
+INITIAL_FIELDS = ('level1', 'level2', 'tank1_max', 'tank2_max', 'setpoint1', 'setpoint2', 'Kp', 'Ki', 'Kd',
+                  'thresholds1', 'thresholds2', 'failsafe_level')
+
+
+def _set_power(engine, on):
+    if engine.power_on != on:
+        engine.simulate_power_loss()
+
+
+def _set_sensor(engine, working):
+    if engine.sensor_working != working:
+        engine.simulate_sensor_failure()
+
+
+# Scenario action name -> function(engine, **arguments). Power and sensor actions are idempotent, unlike the
+# toggling buttons, so a timeline reads the same no matter what happened before.
+ACTIONS = {
+    'power_loss': lambda engine: _set_power(engine, False),
+    'power_restore': lambda engine: _set_power(engine, True),
+    'sensor_failure': lambda engine: _set_sensor(engine, False),
+    'sensor_restore': lambda engine: _set_sensor(engine, True),
+    'start_water_flow': lambda engine: engine.start_water_flow(),
+    'stop_water_flow': lambda engine: engine.stop_water_flow(),
+    'start_water_drain': lambda engine: engine.start_water_drain(),
+    'stop_water_drain': lambda engine: engine.stop_water_drain(),
+    'set_setpoints': lambda engine, setpoint1=None, setpoint2=None: engine.set_setpoints(
+        engine.setpoint1 if setpoint1 is None else setpoint1, engine.setpoint2 if setpoint2 is None else setpoint2),
+    'set_pid_parameters': lambda engine, kp=None, ki=None, kd=None: engine.set_pid_parameters(
+        engine.Kp if kp is None else kp, engine.Ki if ki is None else ki, engine.Kd if kd is None else kd),
+}
+RESULT_COLUMNS = ('name', 'file', 'passed', 'failures', 'sim_time', 'steps', 'max_level1', 'max_level2',
+                  'final_level1', 'final_level2', 'failsafe', 'failsafe_time', 'overflow', 'alarm_events', 'elapsed')
+
+
+def load_scenario(path):
+    with open(path) as file:
+        if path.endswith(('.yaml', '.yml')):
+            import yaml  # only needed for YAML scenarios
+            scenario = yaml.safe_load(file)
+        else:
+            scenario = json.load(file)
+    scenario.setdefault('name', os.path.splitext(os.path.basename(path))[0])
+    scenario['file'] = path
+    for event in scenario.get('events', []):
+        if event.get('action') not in ACTIONS:
+            raise ValueError(f"{path}: unknown action {event.get('action')!r} (expected one of {', '.join(ACTIONS)})")
+    unknown = set(scenario.get('initial', {})) - set(INITIAL_FIELDS)
+    if unknown:
+        raise ValueError(f"{path}: unknown initial fields {', '.join(sorted(unknown))}")
+    return scenario
+
+
+# Runs one scenario on a headless TankEngine. Scheduled events sit in a heap ordered by simulated time (ties
+# keep file order); the engine is run in one go up to the next event, so quiet stretches cost nothing extra.
+class ScenarioRunner:
+    def __init__(self, scenario, logger=None):
+        self.scenario = scenario
+        self.engine = TankEngine(time_step=scenario.get('time_step', 0.1), logger=logger, record_history=False,
+                                 integrator=INTEGRATORS[scenario.get('integrator', 'euler')]())
+        engine = self.engine
+        for name, value in scenario.get('initial', {}).items():
+            setattr(engine, name, tuple(value) if isinstance(value, list) else value)
+        engine.build_thresholds()
+
+        self.queue = []
+        for order, event in enumerate(scenario.get('events', [])):
+            arguments = {key: value for key, value in event.items() if key not in ('time', 'action')}
+            heapq.heappush(self.queue, (float(event['time']), order, event['action'], arguments))
+
+        self.max_level = [engine.level1, engine.level2]
+        self.failsafe_time = math.nan
+        self.overflow = False
+        self.alarm_events = 0
+        engine.subscribe(self.on_engine_update)
+        engine.thresholds.subscribe(self.on_threshold_events, kinds=['failsafe', 'overflow', 'alarm'])
+
+    def on_engine_update(self, engine, status):
+        if engine.level1 > self.max_level[0]:
+            self.max_level[0] = engine.level1
+        if engine.level2 > self.max_level[1]:
+            self.max_level[1] = engine.level2
+
+    def on_threshold_events(self, events):
+        for event in events:
+            if not event.rising:
+                continue
+            if event.kind == 'failsafe' and math.isnan(self.failsafe_time):
+                self.failsafe_time = event.time
+            elif event.kind == 'overflow':
+                self.overflow = True
+            elif event.kind == 'alarm':
+                self.alarm_events += 1
+
+    def run_until(self, end_time):
+        engine = self.engine
+        steps = math.ceil((end_time - engine.time) / engine.time_step - 1e-9)
+        if steps <= 0:
+            return
+        if not engine.power_on:
+            # A powered-off engine holds its state and does not advance its own clock; the timeline still must
+            engine.tick += steps
+            engine.time = round(engine.time + steps * engine.time_step, 9)
+            return
+        engine.run(steps=steps)
+
+    def run(self):
+        engine = self.engine
+        duration = float(self.scenario['duration'])
+        started = wall_time.perf_counter()
+        while self.queue and self.queue[0][0] <= duration:
+            event_time, _, action, arguments = heapq.heappop(self.queue)
+            self.run_until(event_time)
+            ACTIONS[action](engine, **arguments)
+        self.run_until(duration)
+
+        result = {
+            'name': self.scenario['name'],
+            'file': self.scenario.get('file', ''),
+            'sim_time': engine.time,
+            'steps': engine.tick,
+            'max_level1': self.max_level[0],
+            'max_level2': self.max_level[1],
+            'final_level1': engine.level1,
+            'final_level2': engine.level2,
+            'failsafe': not math.isnan(self.failsafe_time),
+            'failsafe_time': self.failsafe_time,
+            'overflow': self.overflow,
+            'alarm_events': self.alarm_events,
+            'elapsed': wall_time.perf_counter() - started,
+        }
+        failures = check_expectations(result, self.scenario.get('expect', {}))
+        result['passed'] = not failures
+        result['failures'] = '; '.join(failures)
+        return result
+
+
+def check_expectations(result, expect):
+    # Each expectation is either an exact value or a {"min": ..., "max": ...} range on a result column
+    failures = []
+    for name, expected in expect.items():
+        value = result.get(name)
+        if isinstance(expected, dict):
+            low, high = expected.get('min', -math.inf), expected.get('max', math.inf)
+            if value is None or not low <= value <= high:
+                failures.append(f"{name}={value} outside [{low}, {high}]")
+        elif value != expected:
+            failures.append(f"{name}={value}, expected {expected}")
+    return failures
+
+
+def run_scenario(path, quiet=True):
+    logger = logging.getLogger('TankSimulation.scenario')
+    if quiet:
+        logger.propagate = False
+        if not logger.handlers:
+            logger.addHandler(logging.NullHandler())
+    return ScenarioRunner(load_scenario(path), logger=logger).run()
+
+
+def run_scenarios(paths, processes=None, quiet=True):
+    if processes == 1 or len(paths) < 2:
+        return [run_scenario(path, quiet) for path in paths]
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        return list(pool.map(run_scenario, paths, [quiet] * len(paths)))
+
+
+def write_results(results, filename):
+    with open(filename, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=RESULT_COLUMNS)
+        writer.writeheader()
+        writer.writerows(results)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run scripted fault-injection scenarios on the headless engine.")
+    parser.add_argument('paths', nargs='+', help="Scenario JSON/YAML files (globs allowed)")
+    parser.add_argument('--processes', type=int)
+    parser.add_argument('--out', help="Write one result row per scenario to this CSV file")
+    parser.add_argument('--verbose', action='store_true', help="Print the engine's event log")
+    args = parser.parse_args()
+
+    if args.verbose:
+        logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO)
+    paths = sorted({match for pattern in args.paths for match in (glob.glob(pattern) or [pattern])})
+    started = wall_time.perf_counter()
+    results = run_scenarios(paths, args.processes, quiet=not args.verbose)
+    elapsed = wall_time.perf_counter() - started
+    if args.out:
+        write_results(results, args.out)
+    for result in results:
+        print(f"{'PASS' if result['passed'] else 'FAIL'} {result['name']}: max {result['max_level1']:.2f}/"
+              f"{result['max_level2']:.2f}%, final {result['final_level1']:.2f}/{result['final_level2']:.2f}%"
+              + (f" ({result['failures']})" if result['failures'] else ""))
+    failed = sum(not result['passed'] for result in results)
+    print(f"Ran {len(results)} scenarios in {elapsed:.2f} s, {failed} failed")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,72 @@
+import threading
+import time as wall_time
+
+
+# Steps a TankEngine on its own thread with a fixed-step accumulator: wall time (scaled by speed) is added
+# to the accumulator and the engine takes as many fixed time_step steps as fit, so simulated time tracks
+# wall time no matter how long the viewer takes to redraw. Subscribers of the engine are called on this
+# thread; anything that touches the engine from another thread should go through call() or hold lock.
+class SimulationWorker:
+    def __init__(self, engine, speed=1.0, max_lag=1.0, batch_steps=1000):
+        self.engine = engine
+        self.speed = speed  # simulated seconds per wall second; float('inf') runs as fast as possible
+        self.max_lag = max_lag  # wall seconds of backlog allowed before steps are dropped
+        self.batch_steps = batch_steps
+        self.lock = threading.RLock()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.dropped_steps = 0
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name='SimulationWorker', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def call(self, function, *args, **kwargs):
+        with self.lock:
+            return function(*args, **kwargs)
+
+    def _run(self):
+        engine = self.engine
+        previous = wall_time.perf_counter()
+        accumulator = 0.0
+        while not self.stop_event.is_set():
+            time_step = engine.time_step
+            if self.speed == float('inf'):
+                with self.lock:
+                    for _ in range(self.batch_steps):
+                        engine.step()
+                continue
+
+            now = wall_time.perf_counter()
+            accumulator += (now - previous) * self.speed
+            previous = now
+            # The backlog is judged in wall time, so at high speeds a short lock hold by the viewer is caught up
+            # instead of being dropped
+            max_backlog = self.max_lag * self.speed
+            if accumulator > max_backlog:
+                # The engine cannot keep up; skip the backlog instead of spiralling further behind
+                dropped = int((accumulator - max_backlog) / time_step)
+                self.dropped_steps += dropped
+                accumulator -= dropped * time_step
+
+            steps = int(accumulator / time_step)
+            if steps:
+                with self.lock:
+                    for _ in range(min(steps, self.batch_steps)):
+                        engine.step()
+                        accumulator -= time_step
+            else:
+                self.stop_event.wait((time_step - accumulator) / self.speed)
@@ -0,0 +1,121 @@
+import argparse
+import time as wall_time
+
+import numpy as np
+
+# (start_fill, slow_down1, slow_down2, stop_fill); tanks alternate between the tank 1 and tank 2 defaults
+DEFAULT_THRESHOLDS = ((30, 80, 90, 95), (20, 80, 90, 95))
+ALARM_LEVELS = (90, 95, 100)
+DRAIN_RATE = 0.5
+
+
+# Many independent tanks stepped together; every state array has shape (n_scenarios, n_tanks)
+class TankBatch:
+    def __init__(self, n_scenarios, n_tanks=2, time_step=0.1):
+        self.shape = (n_scenarios, n_tanks)
+        self.time_step = time_step
+        self.initialize_simulation()
+
+    def initialize_simulation(self):
+        shape = self.shape
+        n_tanks = shape[1]
+        self.tank_max = np.full(shape, 100.0)
+        self.level = np.zeros(shape)
+        self.prev_level = np.zeros(shape)
+        self.time = np.zeros(shape)
+        self.power_on = np.ones(shape, dtype=bool)
+        self.sensor_working = np.ones(shape, dtype=bool)
+        self.water_flow = np.zeros(shape, dtype=bool)
+        self.water_drain = np.zeros(shape, dtype=bool)
+        self.setpoint = np.full(shape, 50.0)
+        self.Kp = np.full(shape, 0.5)
+        self.Ki = np.full(shape, 0.1)
+        self.Kd = np.full(shape, 0.05)
+        self.integral = np.zeros(shape)
+        self.prev_error = np.zeros(shape)
+        self.thresholds = np.broadcast_to(
+            np.array([DEFAULT_THRESHOLDS[i % 2] for i in range(n_tanks)], dtype=float),
+            shape + (4,)).copy()
+        self.failsafe_level = np.full(shape, 98.0)
+        self.tick = 0
+
+        # Per-tank run statistics, updated every step
+        self.max_level = np.zeros(shape)
+        self.crossing_time = np.full(shape + (4,), np.nan)  # first time each threshold was reached
+        self.crossing_count = np.zeros(shape + (4,), dtype=np.int64)
+        self.failsafe_time = np.full(shape, np.nan)
+        self.overflow = np.zeros(shape, dtype=bool)
+        self.failsafe = np.zeros(shape, dtype=bool)
+        self.alarm_level = np.zeros(shape, dtype=np.int64)
+
+    def set_pid_parameters(self, kp, ki, kd):
+        self.Kp[...] = kp
+        self.Ki[...] = ki
+        self.Kd[...] = kd
+
+    def set_setpoints(self, *setpoints):
+        self.setpoint[...] = setpoints if len(setpoints) > 1 else setpoints[0]
+
+    def step(self, inflow_scale=1.0, measurement_noise=None):
+        dt = self.time_step
+        running = self.power_on
+        sensing = running & self.sensor_working
+        self.tick += 1
+        self.time += np.where(running, dt, 0.0)
+
+        measured = self.level if measurement_noise is None else self.level + measurement_noise
+        fill = sensing & self.water_flow
+        error = self.setpoint - measured
+        integral = self.integral + error * dt
+        derivative = (error - self.prev_error) / dt
+        output = np.clip(self.Kp * error + self.Ki * integral + self.Kd * derivative, 0, 1)
+        self.integral = np.where(fill, integral, self.integral)
+        self.prev_error = np.where(fill, error, self.prev_error)
+        level = np.where(fill, np.minimum(self.level + output * inflow_scale * dt, self.tank_max), self.level)
+
+        drain = sensing & self.water_drain
+        level = np.where(drain, np.maximum(level - DRAIN_RATE * dt, 0), level)
+        self.level = level
+
+        self.update_thresholds(running)
+        self.prev_level = np.where(running, level, self.prev_level)
+
+    def update_thresholds(self, running):
+        level = self.level
+        crossed = (level[..., None] >= self.thresholds) & (self.prev_level[..., None] < self.thresholds)
+        crossed &= running[..., None]
+        self.crossing_count += crossed
+        first = crossed & np.isnan(self.crossing_time)
+        self.crossing_time[first] = np.broadcast_to(self.time[..., None], first.shape)[first]
+
+        self.max_level = np.maximum(self.max_level, level)
+        self.overflow = level >= self.tank_max
+        self.failsafe = level >= self.failsafe_level
+        newly_failed = self.failsafe & np.isnan(self.failsafe_time)
+        self.failsafe_time[newly_failed] = self.time[newly_failed]
+        self.alarm_level = np.select([level >= 100, level >= 95, level >= 90], ALARM_LEVELS, 0)
+
+    def run(self, duration=None, steps=None):
+        if steps is None:
+            steps = int(round(duration / self.time_step))
+        for _ in range(steps):
+            self.step()
+        return self
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Step many independent tanks at once with NumPy.")
+    parser.add_argument('--scenarios', type=int, default=10000)
+    parser.add_argument('--tanks', type=int, default=2)
+    parser.add_argument('--duration', type=float, default=600)
+    parser.add_argument('--time-step', type=float, default=0.1)
+    args = parser.parse_args()
+
+    batch = TankBatch(args.scenarios, args.tanks, time_step=args.time_step)
+    batch.water_flow[...] = True
+    started = wall_time.perf_counter()
+    batch.run(args.duration)
+    elapsed = wall_time.perf_counter() - started
+    tank_steps = batch.tick * batch.level.size
+    print(f"Stepped {batch.level.size} tanks for {batch.tick} steps in {elapsed:.2f} s ({tank_steps / elapsed:.3g} tank-steps/s)")
+    print(f"Mean level: {batch.level.mean():.2f}%  Tanks past failsafe: {int(np.count_nonzero(batch.failsafe_time >= 0))}")
@@ -0,0 +1,290 @@
+import argparse
+import logging
+import time as wall_time
+
+from history import HistoryBuffer
+from integrators import INTEGRATORS, EulerIntegrator
+from thresholds import ThresholdRegistry
+
+
+class TankEngine:
+    def __init__(self, time_step=0.1, logger=None, record_history=True, history_window=3600, history_spill_path=None,
+                 integrator=None, profiler=None):
+        self.time_step = time_step
+        self.profiler = profiler  # optional profiling.Profiler; None keeps the hot path uninstrumented
+        self.integrator = integrator if integrator is not None else EulerIntegrator()
+        self.logger = logger if logger is not None else logging.getLogger('TankSimulation')
+        self.record_history = record_history
+        self.history_window = history_window
+        self.history_spill_path = history_spill_path
+        self.build_history()
+        self.subscribers = []
+        self.thresholds = None
+        self.initialize_simulation()
+
+    def initialize_simulation(self):
+        self.tank1_max = 100
+        self.tank2_max = 100
+        self.level1 = 0
+        self.level2 = 0
+        self.tick = 0
+        self.time = 0
+        self.history.clear()
+        self.power_on = True
+        self.sensor_working = True
+        self.water_flow = False
+        self.water_drain = False
+        self.setpoint1 = 50  # Desired level for tank 1
+        self.setpoint2 = 50  # Desired level for tank 2
+        self.Kp = 0.5  # Proportional gain
+        self.Ki = 0.1  # Integral gain
+        self.Kd = 0.05  # Derivative gain
+        self.integral1 = 0
+        self.integral2 = 0
+        self.prev_error1 = 0
+        self.prev_error2 = 0
+        # (start_fill, slow_down1, slow_down2, stop_fill) per tank
+        self.thresholds1 = (30, 80, 90, 95)
+        self.thresholds2 = (20, 80, 90, 95)
+        self.failsafe_level = 98
+        self.alarm_level = None
+        self.build_thresholds()
+
+    def build_history(self):
+        # Sized for the current time step, so the buffer always holds history_window simulated seconds
+        self.history = HistoryBuffer(int(round(self.history_window / self.time_step)) if self.record_history else 1,
+                                     spill_path=self.history_spill_path)
+
+    def build_thresholds(self):
+        # Tank indices in the registry are 0-based; log messages use tank numbers 1 and 2. Subscribers (alarms,
+        # scenario statistics, telemetry) carry over when the registry is rebuilt, e.g. on a checkpoint restore.
+        previous = self.thresholds
+        self.thresholds = ThresholdRegistry(2)
+        for tank, thresholds, tank_max in ((0, self.thresholds1, self.tank1_max), (1, self.thresholds2, self.tank2_max)):
+            for threshold in thresholds:
+                self.thresholds.add(tank, threshold, kind='log')
+            for threshold in (90, 95, 100):
+                self.thresholds.add(tank, threshold, kind='alarm', falling=True)
+            self.thresholds.add(tank, self.failsafe_level, name='failsafe', kind='failsafe')
+            self.thresholds.add(tank, tank_max, name='overflow', kind='overflow')
+        if previous is not None:
+            self.thresholds.subscribers = previous.subscribers
+        else:
+            self.thresholds.subscribe(self.log_thresholds, kinds=['log'])
+        self.thresholds.reset([self.level1, self.level2])
+
+    @property
+    def times(self):
+        return self.history['time']
+
+    @property
+    def levels1(self):
+        return self.history['level1']
+
+    @property
+    def levels2(self):
+        return self.history['level2']
+
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self.subscribers:
+            self.subscribers.remove(callback)
+
+    def notify(self, status=None):
+        for callback in list(self.subscribers):
+            callback(self, status)
+
+    def pid_control(self, level, setpoint, integral, prev_error):
+        error = setpoint - level
+        integral += error * self.time_step
+        derivative = (error - prev_error) / self.time_step
+        output = self.Kp * error + self.Ki * integral + self.Kd * derivative
+        return max(0, min(1, output)), integral, error
+
+    def calculate_control(self, level, start_fill, slow_down1, slow_down2, stop_fill, is_draining=False):
+        if is_draining:
+            return 0.5  # Constant drain rate
+        if level < start_fill:
+            return 1
+        elif start_fill <= level < slow_down1:
+            return 1
+        elif slow_down1 <= level < slow_down2:
+            return 0.5
+        elif slow_down2 <= level < stop_fill:
+            return 0.25
+        else:
+            return 0
+
+    def step(self):
+        profiler = self.profiler
+        if profiler is not None:
+            start = profiler.clock()
+        if not self.power_on:
+            self.notify("System Status: Power Off")
+            return
+
+        if self.sensor_working and self.integrator.adaptive:
+            # Publishes every internal step, including the exact threshold crossings
+            self.integrator.integrate(self, self.time + self.time_step)
+            if profiler is not None:
+                profiler.add('step', start)
+            return
+
+        self.tick += 1
+        # Rounded so repeated addition does not accumulate float noise such as 0.30000000000000004
+        self.time = round(self.time + self.time_step, 9)
+        status = None
+
+        if self.sensor_working:
+            self.integrator.advance(self, self.time_step)
+        else:
+            status = "System Status: Sensor Failure"
+
+        self.publish(status)
+        if profiler is not None:
+            profiler.add('step', start)
+
+    def load_sample(self, tick, time, level1, level2):
+        # Feeds externally produced levels (e.g. a recorded run) through the same checks, logging and subscribers
+        self.tick = tick
+        self.time = time
+        self.level1 = level1
+        self.level2 = level2
+        self.publish()
+
+    def publish(self, status=None):
+        profiler = self.profiler
+        if profiler is not None:
+            start = profiler.clock()
+        self.thresholds.evaluate((self.level1, self.level2), self.time)
+        if self.thresholds.highest_active('failsafe') is not None:
+            status = "EMERGENCY: Critical level reached. Shutting down pumps."
+        elif self.thresholds.highest_active('overflow') is not None:
+            status = "WARNING: Tank overflow detected!"
+        alarm_level = self.thresholds.highest_active('alarm')
+        self.alarm_level = None if alarm_level is None else int(alarm_level)
+
+        if profiler is not None:
+            profiler.add('thresholds', start)
+            start = profiler.clock()
+
+        if self.record_history:
+            self.history.append(self.time, self.level1, self.level2)
+        if profiler is not None:
+            profiler.add('history', start)
+            start = profiler.clock()
+
+        self.notify(status)
+        if profiler is not None:
+            profiler.add('subscribers', start)
+
+    def run(self, duration=None, steps=None):
+        if steps is None:
+            steps = int(round(duration / self.time_step))
+        if self.integrator.adaptive and self.power_on and self.sensor_working:
+            self.integrator.integrate(self, self.time + steps * self.time_step)
+            return self
+        for _ in range(steps):
+            self.step()
+        return self
+
+    def log(self, level, message, event, **fields):
+        # Records carry the simulated time and an event name for the structured (JSON lines) log
+        self.logger.log(level, message, extra={'sim_time': self.time, 'event': event, **fields})
+
+    def log_thresholds(self, events):
+        profiler = self.profiler
+        if profiler is not None:
+            start = profiler.clock()
+        for event in events:
+            self.logger.info(f"Tank {event.tank + 1} reached {event.threshold:g}% level at {event.time:.3f} s",
+                             extra={'sim_time': event.time, 'tank': event.tank + 1, 'event': 'threshold',
+                                    'threshold': event.threshold})
+        if profiler is not None:
+            profiler.add('logging', start)
+
+    def set_pid_parameters(self, kp, ki, kd):
+        self.Kp = kp
+        self.Ki = ki
+        self.Kd = kd
+
+    def set_setpoints(self, setpoint1, setpoint2):
+        self.setpoint1 = setpoint1
+        self.setpoint2 = setpoint2
+
+    def simulate_power_loss(self):
+        self.power_on = not self.power_on
+        if self.power_on:
+            self.log(logging.INFO, "Power restored", 'power_restored')
+            self.notify("System Status: Power Restored")
+        else:
+            self.log(logging.WARNING, "Power loss", 'power_loss')
+            self.notify("System Status: Power Loss")
+
+    def simulate_sensor_failure(self):
+        self.sensor_working = not self.sensor_working
+        if self.sensor_working:
+            self.log(logging.INFO, "Sensors restored", 'sensor_restored')
+            self.notify("System Status: Sensors Restored")
+        else:
+            self.log(logging.WARNING, "Sensor failure occurred", 'sensor_failure')
+            self.notify("System Status: Sensor Failure")
+
+    def start_water_flow(self):
+        self.water_flow = True
+        self.log(logging.INFO, "Water flow started", 'flow_started')
+        self.notify("System Status: Water Flow Started")
+
+    def stop_water_flow(self):
+        self.water_flow = False
+        self.log(logging.INFO, "Water flow stopped", 'flow_stopped')
+        self.notify("System Status: Water Flow Stopped")
+
+    def start_water_drain(self):
+        self.water_drain = True
+        self.log(logging.INFO, "Water drain started", 'drain_started')
+        self.notify("System Status: Water Drain Started")
+
+    def stop_water_drain(self):
+        self.water_drain = False
+        self.log(logging.INFO, "Water drain stopped", 'drain_stopped')
+        self.notify("System Status: Water Drain Stopped")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run the two-tank simulation without a GUI.")
+    parser.add_argument('--duration', type=float, default=86400, help="Simulated time in seconds")
+    parser.add_argument('--time-step', type=float, default=0.1)
+    parser.add_argument('--flow', action='store_true', help="Start with water flow on")
+    parser.add_argument('--drain', action='store_true', help="Start with water drain on")
+    parser.add_argument('--integrator', choices=sorted(INTEGRATORS), default='euler')
+    parser.add_argument('--network', help="JSON tank network layout; tanks 1 and 2 are its first two tanks and are "
+                                          "stepped together with its pipes, valves and pumps (replaces --integrator)")
+    parser.add_argument('--log-file', help="Also write events as JSON lines to this (size-rotated) file")
+    args = parser.parse_args()
+
+    from event_log import setup_logging  # only the CLI needs the queued log writer
+    log_writer = setup_logging(filename=args.log_file)
+    if args.network:
+        from hydraulics import NetworkIntegrator, load_network
+        integrator = NetworkIntegrator(load_network(args.network, time_step=args.time_step))
+    else:
+        integrator = INTEGRATORS[args.integrator]()
+    engine = TankEngine(time_step=args.time_step, record_history=False, integrator=integrator)
+    if args.flow:
+        engine.start_water_flow()
+    if args.drain:
+        engine.start_water_drain()
+
+    started = wall_time.perf_counter()
+    engine.run(args.duration)
+    elapsed = wall_time.perf_counter() - started
+    log_writer.stop()
+    print(f"Simulated {engine.time:.1f} s in {engine.tick} steps, {elapsed:.2f} s ({engine.tick / elapsed:.0f} steps/s)")
+    print(f"Tank 1 level: {engine.level1:.2f}%  Tank 2 level: {engine.level2:.2f}%")
+    if args.network:
+        network = integrator.network
+        print(f"Network: {network.n_tanks} tanks, volume {network.volume():.2f}, "
+              f"balance error {network.volume_error():.3g}")
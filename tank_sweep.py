@@ -0,0 +1,151 @@
+import argparse
+import csv
+import os
+import time as wall_time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from tank_batch import TankBatch
+
+# Defaults match TankEngine.initialize_simulation and the calculate_control thresholds (30/20/80/90/95)
+SWEEP_DEFAULTS = {
+    'kp': 0.5,
+    'ki': 0.1,
+    'kd': 0.05,
+    'setpoint1': 50,
+    'setpoint2': 50,
+    'start_fill1': 30,
+    'start_fill2': 20,
+    'slow_down1': 80,
+    'slow_down2': 90,
+    'stop_fill': 95,
+}
+THRESHOLD_NAMES = ('start_fill', 'slow_down1', 'slow_down2', 'stop_fill')
+# First time each tank reached each control threshold, e.g. slow_down1_time2; NaN if it never did
+CROSSING_COLUMNS = tuple(f"{name}_time{tank}" for tank in (1, 2) for name in THRESHOLD_NAMES)
+RESULT_COLUMNS = ('overshoot1', 'overshoot2', 'settling_time1', 'settling_time2', 'failsafe_time') + CROSSING_COLUMNS
+
+
+def grid(**values):
+    names = list(SWEEP_DEFAULTS)
+    axes = [np.atleast_1d(np.asarray(values.get(name, SWEEP_DEFAULTS[name]), dtype=float)) for name in names]
+    mesh = np.meshgrid(*axes, indexing='ij')
+    return {name: axis.ravel() for name, axis in zip(names, mesh)}
+
+
+def random_samples(n, seed=None, **ranges):
+    rng = np.random.default_rng(seed)
+    params = {}
+    for name, default in SWEEP_DEFAULTS.items():
+        value = ranges.get(name, default)
+        if isinstance(value, tuple):
+            low, high = value
+            params[name] = rng.uniform(low, high, n)
+        elif np.ndim(value) == 0:
+            params[name] = np.full(n, float(value))
+        else:
+            params[name] = rng.choice(np.asarray(value, dtype=float), n)
+    return params
+
+
+def _run_chunk(params, duration, time_step, settle_band):
+    n = len(params['kp'])
+    batch = TankBatch(n, 2, time_step=time_step)
+    batch.set_pid_parameters(params['kp'][:, None], params['ki'][:, None], params['kd'][:, None])
+    batch.setpoint[:, 0] = params['setpoint1']
+    batch.setpoint[:, 1] = params['setpoint2']
+    batch.thresholds[:, 0, 0] = params['start_fill1']
+    batch.thresholds[:, 1, 0] = params['start_fill2']
+    batch.thresholds[:, :, 1] = params['slow_down1'][:, None]
+    batch.thresholds[:, :, 2] = params['slow_down2'][:, None]
+    batch.thresholds[:, :, 3] = params['stop_fill'][:, None]
+    batch.water_flow[...] = True
+
+    last_outside = np.zeros(batch.shape)
+    for _ in range(int(round(duration / time_step))):
+        batch.step()
+        outside = np.abs(batch.level - batch.setpoint) > settle_band
+        last_outside = np.where(outside, batch.time, last_outside)
+
+    overshoot = np.maximum(batch.max_level - batch.setpoint, 0)
+    # Still outside the band at the end of the run means the tank never settled
+    settling = np.where(last_outside >= batch.time, np.nan, last_outside)
+    failsafe = np.fmin.reduce(batch.failsafe_time, axis=1)
+    results = {
+        'overshoot1': overshoot[:, 0],
+        'overshoot2': overshoot[:, 1],
+        'settling_time1': settling[:, 0],
+        'settling_time2': settling[:, 1],
+        'failsafe_time': failsafe,
+    }
+    for column, (tank, threshold) in zip(CROSSING_COLUMNS, np.ndindex(2, len(THRESHOLD_NAMES))):
+        results[column] = batch.crossing_time[:, tank, threshold]
+    return results
+
+
+def run_sweep(params, duration=600, time_step=0.1, settle_band=2.0, processes=None, chunks_per_process=4):
+    params = {name: np.asarray(params.get(name, SWEEP_DEFAULTS[name]), dtype=float) for name in SWEEP_DEFAULTS}
+    n = len(params['kp'])
+    processes = processes or os.cpu_count() or 1
+    n_chunks = max(1, min(n, processes * chunks_per_process))
+    bounds = np.linspace(0, n, n_chunks + 1).astype(int)
+    chunks = [{name: values[start:stop] for name, values in params.items()}
+              for start, stop in zip(bounds[:-1], bounds[1:])]
+
+    if processes == 1:
+        outputs = [_run_chunk(chunk, duration, time_step, settle_band) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            outputs = list(pool.map(_run_chunk, chunks, [duration] * n_chunks,
+                                    [time_step] * n_chunks, [settle_band] * n_chunks))
+
+    results = dict(params)
+    for column in RESULT_COLUMNS:
+        results[column] = np.concatenate([output[column] for output in outputs])
+    return results
+
+
+def write_results(results, filename):
+    columns = list(results)
+    with open(filename, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(columns)
+        writer.writerows(zip(*(results[column].tolist() for column in columns)))
+
+
+def _parse_values(text, sampling):
+    if ':' in text:
+        parts = [float(part) for part in text.split(':')]
+        if sampling:
+            return parts[0], parts[1]
+        return np.linspace(parts[0], parts[1], int(parts[2]) if len(parts) > 2 else 5)
+    values = [float(part) for part in text.split(',')]
+    return values[0] if len(values) == 1 else values
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Sweep PID gains, setpoints and control thresholds over a process pool. "
+                    "Values are a single number, a comma list, or start:stop[:count] "
+                    "(low:high when --samples is used).")
+    for name, default in SWEEP_DEFAULTS.items():
+        parser.add_argument('--' + name.replace('_', '-'), dest=name, default=str(default))
+    parser.add_argument('--samples', type=int, help="Draw this many random samples instead of a full grid")
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--duration', type=float, default=600)
+    parser.add_argument('--time-step', type=float, default=0.1)
+    parser.add_argument('--settle-band', type=float, default=2.0, help="Settling band around the setpoint in % level")
+    parser.add_argument('--processes', type=int)
+    parser.add_argument('--out', default='sweep_results.csv')
+    args = parser.parse_args()
+
+    sampling = args.samples is not None
+    values = {name: _parse_values(getattr(args, name), sampling) for name in SWEEP_DEFAULTS}
+    params = random_samples(args.samples, args.seed, **values) if sampling else grid(**values)
+
+    started = wall_time.perf_counter()
+    results = run_sweep(params, args.duration, args.time_step, args.settle_band, args.processes)
+    elapsed = wall_time.perf_counter() - started
+    write_results(results, args.out)
+    print(f"Ran {len(results['kp'])} combinations in {elapsed:.2f} s. Results saved to {args.out}")
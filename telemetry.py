@@ -0,0 +1,357 @@
+import argparse
+import asyncio
+import json
+import logging
+import struct
+import threading
+import time as wall_time
+from collections import deque
+
+KEYFRAME, DELTA, EVENT = 1, 2, 3
+# Sampled every tick; a delta frame carries only the fields that changed since the previous sample
+FIELDS = ('time', 'level1', 'level2', 'setpoint1', 'setpoint2', 'Kp', 'Ki', 'Kd', 'alarm_level')
+FLAGS = ('power_on', 'sensor_working', 'water_flow', 'water_drain')
+FLAGS_BIT = 1 << len(FIELDS)
+HEADER = struct.Struct('<HBI')  # length of the rest of the frame, frame type, sequence number
+KEY = struct.Struct('<q%ddB' % len(FIELDS))  # tick, every field, flags
+DELTA_HEADER = struct.Struct('<HH')  # tick increment, bit mask of the fields (and flags) that follow
+VALUE = struct.Struct('<d')
+
+
+def sample(engine):
+    # (tick, field values, flag bits) of the engine's current state
+    alarm_level = engine.alarm_level or 0
+    return (engine.tick,
+            (engine.time, engine.level1, engine.level2, engine.setpoint1, engine.setpoint2,
+             engine.Kp, engine.Ki, engine.Kd, alarm_level),
+            engine.power_on | engine.sensor_working << 1 | engine.water_flow << 2 | engine.water_drain << 3)
+
+
+# Turns samples into a stream of length-prefixed binary frames. The first sample is a keyframe with the full
+# state; after that each sample is a delta against the previous one: the tick increment, a mask and only the
+# fields that changed. Every frame takes the next sequence number, so a reader can tell when it missed one.
+class FrameEncoder:
+    def __init__(self):
+        self.sequence = 0
+        self.previous = None
+
+    def frame(self, kind, payload, sequence=None):
+        if sequence is None:
+            self.sequence = (self.sequence + 1) & 0xFFFFFFFF
+            sequence = self.sequence
+        return HEADER.pack(len(payload) + HEADER.size - 2, kind, sequence) + payload
+
+    def state(self, sample):
+        previous = self.previous
+        self.previous = sample
+        tick, values, flags = sample
+        if previous is None or not 0 <= tick - previous[0] <= 0xFFFF:
+            return self.frame(KEYFRAME, KEY.pack(tick, *values, flags))
+        mask = 0
+        changed = []
+        for bit, (value, old) in enumerate(zip(values, previous[1])):
+            if value != old:
+                mask |= 1 << bit
+                changed.append(VALUE.pack(value))
+        if flags != previous[2]:
+            mask |= FLAGS_BIT
+            changed.append(bytes((flags,)))
+        return self.frame(DELTA, DELTA_HEADER.pack(tick - previous[0], mask) + b''.join(changed))
+
+    def keyframe(self):
+        # The last state again, for a reader that has to resync; it reuses the current sequence number so the
+        # frames that follow it are still in order
+        if self.previous is None:
+            return b''
+        tick, values, flags = self.previous
+        return self.frame(KEYFRAME, KEY.pack(tick, *values, flags), self.sequence)
+
+    def event(self, data):
+        return self.frame(EVENT, json.dumps(data, separators=(',', ':')).encode())
+
+
+# Rebuilds messages from the frame stream: ('state', dict) for every sample and ('event', dict) for events.
+# After a gap in the sequence numbers, deltas are ignored until the next keyframe.
+class FrameDecoder:
+    def __init__(self):
+        self.buffer = bytearray()
+        self.state = None
+        self.expected = None
+        self.lost = 0
+
+    def feed(self, data):
+        self.buffer += data
+        messages = []
+        offset = 0
+        while len(self.buffer) - offset >= 2:
+            length, = struct.unpack_from('<H', self.buffer, offset)
+            if len(self.buffer) - offset < length + 2:
+                break
+            message = self.decode(memoryview(self.buffer)[offset:offset + length + 2])
+            offset += length + 2
+            if message is not None:
+                messages.append(message)
+        del self.buffer[:offset]
+        return messages
+
+    def decode(self, frame):
+        _, kind, sequence = HEADER.unpack_from(frame)
+        payload = frame[HEADER.size:]
+        if kind != KEYFRAME and self.expected is not None and sequence != self.expected:
+            self.lost += 1
+            self.state = None
+        self.expected = (sequence + 1) & 0xFFFFFFFF
+        if kind == EVENT:
+            return 'event', json.loads(bytes(payload))
+        if kind == KEYFRAME:
+            tick, *values, flags = KEY.unpack_from(payload)
+        elif self.state is None:
+            return None
+        else:
+            increment, mask = DELTA_HEADER.unpack_from(payload)
+            tick, values, flags = self.state
+            tick += increment
+            values = list(values)
+            offset = DELTA_HEADER.size
+            for bit in range(len(FIELDS)):
+                if mask >> bit & 1:
+                    values[bit], = VALUE.unpack_from(payload, offset)
+                    offset += VALUE.size
+            if mask & FLAGS_BIT:
+                flags = payload[offset]
+        self.state = (tick, values, flags)
+        message = {'tick': tick, **dict(zip(FIELDS, values))}
+        message.update((name, bool(flags >> bit & 1)) for bit, name in enumerate(FLAGS))
+        return 'state', message
+
+
+# One connected reader with its own bounded queue of chunks. When the queue is full the newest chunk is
+# dropped and the reader is resynced with a keyframe, so a slow reader only ever loses its own frames.
+class Subscriber:
+    def __init__(self, writer, max_queue):
+        self.writer = writer
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.resync = False
+        self.dropped = 0
+        self.task = None
+
+
+# Publishes an engine's state and events to any number of TCP readers on a background asyncio thread. The
+# engine subscriber only appends a sample to a deque, so the simulation loop never waits on a socket; the
+# server thread encodes whatever has accumulated every interval seconds into one chunk and queues it to each
+# reader. If the server falls behind by more than max_pending samples, the oldest are skipped.
+class TelemetryServer:
+    def __init__(self, host='127.0.0.1', port=8765, interval=0.05, max_queue=64, max_pending=100000, every=1,
+                 logger=None):
+        self.host = host
+        self.port = port
+        self.interval = interval
+        self.max_queue = max_queue
+        self.every = every  # publish every nth tick
+        self.logger = logger if logger is not None else logging.getLogger('TankSimulation')
+        self.pending = deque(maxlen=max_pending)
+        self.encoder = FrameEncoder()
+        self.subscribers = set()
+        self.last_status = None
+        self.skipped = 0
+        self.thread = None
+        self.loop = None
+        self.stopping = None
+        self.error = None
+
+    def attach(self, engine):
+        engine.subscribe(self.on_engine_update)
+        engine.thresholds.subscribe(self.on_threshold_events, kinds=['alarm', 'failsafe', 'overflow'])
+        self.pending.append(sample(engine))
+
+    def detach(self, engine):
+        engine.unsubscribe(self.on_engine_update)
+        engine.thresholds.unsubscribe(self.on_threshold_events)
+
+    def on_engine_update(self, engine, status):
+        if status != self.last_status:
+            self.last_status = status
+            if status is not None:
+                self.pending.append({'time': engine.time, 'status': status})
+        if engine.tick % self.every == 0:
+            if len(self.pending) == self.pending.maxlen:
+                self.skipped += 1
+            self.pending.append(sample(engine))
+
+    def on_threshold_events(self, events):
+        for event in events:
+            self.pending.append({'time': event.time, 'tank': event.tank + 1, 'level': event.level,
+                                 'threshold': event.threshold, 'name': event.name, 'kind': event.kind,
+                                 'rising': event.rising})
+
+    def start(self):
+        ready = threading.Event()
+        self.thread = threading.Thread(target=asyncio.run, args=(self._serve(ready),), name='Telemetry', daemon=True)
+        self.thread.start()
+        ready.wait()
+        if self.error is not None:
+            raise self.error
+        return self.port
+
+    def stop(self):
+        if self.thread is None:
+            return
+        if self.loop is not None and self.loop.is_running():
+            self.loop.call_soon_threadsafe(self.stopping.set)
+        self.thread.join()
+        self.thread = None
+
+    async def _serve(self, ready):
+        self.loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        try:
+            server = await asyncio.start_server(self._handle, self.host, self.port)
+        except OSError as error:
+            self.error = error
+            ready.set()
+            return
+        self.port = server.sockets[0].getsockname()[1]
+        ready.set()
+        self.logger.info(f"Telemetry on {self.host}:{self.port}", extra={'event': 'telemetry_started'})
+        try:
+            while not self.stopping.is_set():
+                self.broadcast()
+                try:
+                    await asyncio.wait_for(self.stopping.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+            self.broadcast()
+        finally:
+            # Readers get what is already queued, within a grace period; stuck connections are then aborted
+            server.close()
+            for subscriber in list(self.subscribers):
+                if subscriber.queue.full():
+                    subscriber.queue.get_nowait()
+                subscriber.queue.put_nowait(None)
+            tasks = [subscriber.task for subscriber in self.subscribers]
+            if tasks:
+                await asyncio.wait(tasks, timeout=1.0)
+            for subscriber in list(self.subscribers):
+                subscriber.writer.transport.abort()
+
+    def broadcast(self):
+        resync = any(subscriber.resync for subscriber in self.subscribers)
+        head = self.encoder.keyframe() if resync else b''
+        frames = []
+        pending = self.pending
+        while pending:
+            item = pending.popleft()
+            frames.append(self.encoder.event(item) if isinstance(item, dict) else self.encoder.state(item))
+        if not frames:
+            return
+        chunk = b''.join(frames)
+        for subscriber in list(self.subscribers):
+            if subscriber.queue.full():
+                subscriber.resync = True
+                subscriber.dropped += 1
+            elif subscriber.resync:
+                subscriber.queue.put_nowait(head + chunk)
+                subscriber.resync = False
+            else:
+                subscriber.queue.put_nowait(chunk)
+
+    async def _handle(self, reader, writer):
+        subscriber = Subscriber(writer, self.max_queue)
+        subscriber.task = asyncio.current_task()
+        # A new reader starts from the last published state
+        head = self.encoder.keyframe()
+        if head:
+            subscriber.queue.put_nowait(head)
+        self.subscribers.add(subscriber)
+        peer = writer.get_extra_info('peername')
+        self.logger.info(f"Telemetry reader {peer} connected", extra={'event': 'telemetry_connected'})
+        try:
+            while True:
+                chunk = await subscriber.queue.get()
+                if chunk is None:
+                    break
+                writer.write(chunk)
+                await writer.drain()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self.subscribers.discard(subscriber)
+            writer.close()
+            self.logger.info(f"Telemetry reader {peer} disconnected ({subscriber.dropped} chunks dropped)",
+                             extra={'event': 'telemetry_disconnected'})
+
+
+async def subscribe(host='127.0.0.1', port=8765):
+    # Yields ('state', dict) and ('event', dict) messages from a TelemetryServer until it closes the connection
+    reader, writer = await asyncio.open_connection(host, port)
+    decoder = FrameDecoder()
+    try:
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            for message in decoder.feed(data):
+                yield message
+    finally:
+        writer.close()
+
+
+async def watch(host, port, record=None, print_interval=1.0):
+    recorder = None
+    if record is not None:
+        from recorder import RunRecorder
+        recorder = RunRecorder(record, format='csv' if record.endswith('.csv') else 'npz')
+    last_print = 0.0
+    try:
+        async for kind, message in subscribe(host, port):
+            if kind == 'event':
+                text = message.get('status') or (f"Tank {message['tank']} {'reached' if message['rising'] else 'fell below'} "
+                                                 f"{message['threshold']:g}% ({message['kind']})")
+                print(f"[{message['time']:10.1f} s] {text}")
+                continue
+            if recorder is not None and (recorder.last_tick is None or message['tick'] > recorder.last_tick):
+                recorder.record(message['tick'], message['time'], message['level1'], message['level2'])
+            now = wall_time.monotonic()
+            if now - last_print >= print_interval:
+                last_print = now
+                print(f"t={message['time']:10.1f} s  tank 1 {message['level1']:6.2f}%  tank 2 {message['level2']:6.2f}%"
+                      f"  alarm {message['alarm_level']:g}")
+    finally:
+        if recorder is not None:
+            recorder.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve a headless engine's telemetry, or watch a telemetry stream.")
+    parser.add_argument('mode', choices=['serve', 'watch'])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--speed', type=float, default=1.0, help="Simulated seconds per wall second (serve)")
+    parser.add_argument('--time-step', type=float, default=0.1)
+    parser.add_argument('--record', metavar='PATH', help="Record the watched levels to a CSV file or npz directory")
+    args = parser.parse_args()
+
+    if args.mode == 'watch':
+        try:
+            asyncio.run(watch(args.host, args.port, args.record))
+        except KeyboardInterrupt:
+            pass
+    else:
+        from simulation_worker import SimulationWorker
+        from tank_engine import TankEngine
+
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+        engine = TankEngine(time_step=args.time_step, record_history=False)
+        engine.start_water_flow()
+        server = TelemetryServer(args.host, args.port)
+        server.attach(engine)
+        server.start()
+        worker = SimulationWorker(engine, speed=args.speed)
+        worker.start()
+        try:
+            while True:
+                wall_time.sleep(1.0)
+        except KeyboardInterrupt:
+            pass
+        worker.stop()
+        server.stop()
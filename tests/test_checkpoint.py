@@ -0,0 +1,99 @@
+import struct
+
+import numpy as np
+import pytest
+
+from checkpoint import fork, fork_batch, load_checkpoint, restore, save_checkpoint, snapshot
+from integrators import RK45Integrator
+from tank_engine import TankEngine
+
+
+def warmed_up(integrator=None, steps=1200, **options):
+    engine = TankEngine(integrator=integrator, history_window=60, **options)
+    engine.set_pid_parameters(0.8, 0.05, 0.1)
+    engine.start_water_flow()
+    for _ in range(steps):
+        engine.step()
+    engine.start_water_drain()
+    for _ in range(steps // 2):
+        engine.step()
+    return engine
+
+
+def test_round_trip_is_byte_identical():
+    engine = warmed_up()
+    data = snapshot(engine)
+    assert snapshot(restore(TankEngine(history_window=60), data)) == data
+
+
+@pytest.mark.parametrize('integrator', [None, RK45Integrator])
+def test_restored_engine_continues_identically(integrator):
+    engine = warmed_up(integrator() if integrator else None)
+    data = snapshot(engine)
+    copy = restore(TankEngine(history_window=60), data)
+    for _ in range(500):
+        engine.step()
+        copy.step()
+    assert (copy.time, copy.level1, copy.level2, copy.integral1) == (engine.time, engine.level1, engine.level2,
+                                                                      engine.integral1)
+    np.testing.assert_array_equal(copy.history['level1'], engine.history['level1'])
+    assert copy.history.count == engine.history.count
+
+
+def test_threshold_state_and_subscribers_survive_restore():
+    engine = warmed_up()
+    engine.level1 = 96.0
+    engine.publish()
+    assert engine.alarm_level == 95
+    target = TankEngine(history_window=60)
+    received = []
+    target.thresholds.subscribe(received.extend, kinds=['alarm'])
+    restore(target, snapshot(engine))
+    assert target.alarm_level == engine.alarm_level
+    assert target.thresholds.band.tolist() == engine.thresholds.band.tolist()
+    target.level1 = target.level2 = 0.0
+    target.publish()
+    assert received and all(not event.rising for event in received)
+
+
+def test_different_time_step_resizes_history():
+    engine = warmed_up()
+    target = TankEngine(time_step=0.5, history_window=60)
+    restore(target, snapshot(engine))
+    assert target.time_step == engine.time_step
+    assert target.history.capacity == 600
+    np.testing.assert_array_equal(target.history['time'], engine.history['time'])
+
+
+def test_without_history():
+    engine = warmed_up()
+    target = restore(TankEngine(history_window=60), snapshot(engine, include_history=False))
+    assert len(target.history) == 0
+    assert target.history.count == engine.history.count
+    assert target.level1 == engine.level1
+
+
+def test_save_load_and_fork(tmp_path):
+    engine = warmed_up()
+    path = str(tmp_path / 'engine.ckpt')
+    save_checkpoint(engine, path)
+    loaded = load_checkpoint(path, history_window=60)
+    assert snapshot(loaded) == snapshot(engine)
+
+    forks = fork(snapshot(engine), 3, history_window=60)
+    forks[0].stop_water_drain()
+    for copy in forks:
+        copy.run(steps=100)
+    assert forks[1].level1 == forks[2].level1 != forks[0].level1
+
+    batch = fork_batch(snapshot(engine), 4)
+    np.testing.assert_array_equal(batch.level, [[engine.level1, engine.level2]] * 4)
+    np.testing.assert_array_equal(batch.integral, [[engine.integral1, engine.integral2]] * 4)
+
+
+def test_rejects_foreign_data():
+    data = snapshot(warmed_up(steps=10))
+    with pytest.raises(ValueError):
+        restore(TankEngine(), b'XXXX' + data[4:])
+    with pytest.raises(ValueError):
+        restore(TankEngine(), data[:4] + struct.pack('<H', 99) + data[6:])
@@ -0,0 +1,78 @@
+import math
+
+import pytest
+
+from integrators import RK4Integrator, RK45Integrator
+from tank_engine import TankEngine
+
+
+def proportional_fill(integrator, kp=0.02):
+    # Pure P control towards 100%: the fill is saturated at 1 %/s up to level 100 - 1 / kp, then the level
+    # approaches 100 exponentially, so every crossing time is known in closed form
+    engine = TankEngine(integrator=integrator, record_history=False)
+    engine.set_pid_parameters(kp, 0.0, 0.0)
+    engine.set_setpoints(100.0, 100.0)
+    engine.water_flow = True
+    return engine
+
+
+def crossing_time(level, kp=0.02):
+    knee = 100.0 - 1.0 / kp
+    if level <= knee:
+        return level
+    return knee + math.log((100.0 - knee) / (100.0 - level)) / kp
+
+
+def record_events(engine):
+    events = []
+
+    def on_events(batch):
+        levels = (engine.level1, engine.level2)
+        events.extend((event, levels[event.tank]) for event in batch)
+
+    engine.thresholds.subscribe(on_events)
+    return events
+
+
+def test_rk45_lands_on_every_crossing():
+    engine = proportional_fill(RK45Integrator())
+    events = record_events(engine)
+    engine.run(400)
+    assert engine.time == pytest.approx(400.0, abs=1e-9)
+    rising = [(event, level) for event, level in events if event.rising]
+    assert {event.threshold for event, _ in rising if event.tank == 0} >= {30, 80, 90, 95, 98}
+    for event, level in rising:
+        # Published exactly on the level, within a tenth of the default fixed step of the analytical time (the
+        # kink where the fill leaves saturation costs a few milliseconds)
+        assert level == event.threshold
+        assert event.time == pytest.approx(crossing_time(event.threshold), abs=0.01)
+
+
+def test_rk45_takes_few_steps_while_nothing_happens():
+    engine = proportional_fill(RK45Integrator(max_step=60.0))
+    engine.water_flow = False
+    engine.run(3600)
+    assert engine.time == pytest.approx(3600.0)
+    assert engine.tick <= 3600 / 60.0 + 5
+
+
+def test_rk4_matches_closed_form():
+    engine = proportional_fill(RK4Integrator())
+    engine.run(200)
+    expected = 100.0 - 50.0 * math.exp(-0.02 * (200.0 - 50.0))
+    assert engine.level1 == pytest.approx(expected, abs=1e-3)
+    assert engine.level2 == pytest.approx(expected, abs=1e-3)
+
+
+def test_rk45_falling_crossings_end_below_the_level():
+    engine = TankEngine(integrator=RK45Integrator(), record_history=False)
+    engine.level1 = engine.level2 = 99.0
+    engine.build_thresholds()
+    events = record_events(engine)
+    engine.water_drain = True
+    engine.run(300)
+    falling = [(event, level) for event, level in events if not event.rising]
+    assert {event.threshold for event, _ in falling if event.tank == 0} == {90, 95}
+    for event, level in falling:
+        assert level < event.threshold
+        assert level == pytest.approx(event.threshold)
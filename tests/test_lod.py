@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+from history import HistoryBuffer
+from lod import MinMaxPyramid, minmax_decimate
+
+
+def filled_history(n, capacity, seed=0, spill_path=None):
+    rng = np.random.default_rng(seed)
+    history = HistoryBuffer(capacity, spill_path=spill_path)
+    levels = np.cumsum(rng.normal(0, 1, (n, 2)), axis=0)
+    for tick in range(n):
+        history.append(tick * 0.1, *levels[tick])
+    return history
+
+
+def test_small_window_is_raw():
+    history = filled_history(500, 1000)
+    times, (levels1, levels2) = MinMaxPyramid(history).query(10.0, 20.0, max_points=1000)
+    start = int(np.searchsorted(history['time'], 10.0)) - 1
+    stop = int(np.searchsorted(history['time'], 20.0, side='right')) + 1
+    np.testing.assert_array_equal(times, history['time'][start:stop])
+    np.testing.assert_array_equal(levels1, history['level1'][start:stop])
+    np.testing.assert_array_equal(levels2, history['level2'][start:stop])
+
+
+@pytest.mark.parametrize('spill', [False, True])
+def test_queries_keep_edges_and_extremes(tmp_path, spill):
+    # Against the raw samples: the curve spans the whole window and keeps every peak and trough, also after
+    # the ring buffer has wrapped and evicted samples
+    history = filled_history(13579, 10000, spill_path=str(tmp_path / 'spill.bin') if spill else None)
+    pyramid = MinMaxPyramid(history)
+    times = history['time']
+    rng = np.random.default_rng(1)
+    for _ in range(200):
+        x0, x1 = np.sort(rng.uniform(times[0] - 10, times[-1] + 10, 2))
+        max_points = int(rng.integers(50, 400))
+        xs, ys = pyramid.query(x0, x1, max_points=max_points)
+        start = max(int(np.searchsorted(times, x0)) - 1, 0)
+        stop = min(int(np.searchsorted(times, x1, side='right')) + 1, len(times))
+        if stop <= start:
+            continue
+        assert xs[0] == times[start]
+        assert xs[-1] == times[stop - 1]
+        assert np.all(np.diff(xs) >= 0)
+        assert len(xs) <= max(max_points + 8, stop - start)
+        for name, y in zip(pyramid.channels, ys):
+            raw = history[name][start:stop]
+            assert y.min() == raw.min()
+            assert y.max() == raw.max()
+
+
+def test_cleared_history_resyncs():
+    history = filled_history(5000, 5000)
+    pyramid = MinMaxPyramid(history)
+    pyramid.query(max_points=100)
+    history.clear()
+    for tick in range(3000):
+        history.append(tick * 0.1, 1.0, -1.0)
+    xs, (levels1, levels2) = pyramid.query(max_points=100)
+    assert set(levels1.tolist()) == {1.0}
+    assert set(levels2.tolist()) == {-1.0}
+    assert xs[-1] == history['time'][-1]
+
+
+def test_minmax_decimate():
+    x = np.arange(10.0)
+    y = np.array([3, 1, 2, 9, 5, 4, 0, 7, 8, 6], dtype=float)
+    xs, (ys,) = minmax_decimate(x, [y], 4)
+    np.testing.assert_array_equal(xs, [0, 0, 4, 4, 8, 8, 9])
+    np.testing.assert_array_equal(ys, [1, 9, 0, 7, 6, 8, 6])
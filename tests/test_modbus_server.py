@@ -0,0 +1,103 @@
+import asyncio
+import struct
+
+import pytest
+
+from modbus_server import HOLDING_REGISTERS, ILLEGAL_ADDRESS, ILLEGAL_FUNCTION, ILLEGAL_VALUE, INPUT_REGISTERS, \
+    READ_HOLDING, READ_INPUT, READ_WRITE_MULTIPLE, WRITE_MULTIPLE, WRITE_SINGLE, ModbusClient, ModbusError, \
+    ModbusServer
+from tank_engine import TankEngine
+
+
+@pytest.fixture
+def server():
+    engine = TankEngine(record_history=False)
+    server = ModbusServer()
+    server.attach(engine)
+    engine.start_water_flow()
+    engine.run(steps=999)
+    engine.tick += 69000  # so the tick needs both words of its register pair
+    engine.step()
+    return server
+
+
+def read(server, function, start, count):
+    response = server.process(struct.pack('>BHH', function, start, count))
+    assert response[:2] == bytes((function, 2 * count))
+    return list(struct.unpack_from(f'>{count}H', response, 2))
+
+
+def test_input_registers(server):
+    engine = server.engine
+    registers = read(server, READ_INPUT, 0, len(INPUT_REGISTERS))
+    assert registers[0] == round(engine.level1 * 100)
+    assert registers[1] == round(engine.level2 * 100)
+    assert registers[2] & 0b1111 == 0b0111  # power on, sensor working, water flow, no drain
+    assert registers[3] == engine.alarm_level
+    assert registers[4] << 16 | registers[5] == engine.tick == 70000
+    assert registers[6] << 16 | registers[7] == int(engine.time * 1000)
+    assert read(server, READ_INPUT, 1, 1) == registers[1:2]
+
+
+def test_writes_change_the_engine(server):
+    engine = server.engine
+    request = struct.pack('>BHH', WRITE_SINGLE, 1, 4250)
+    assert server.process(request) == request
+    assert engine.setpoint1 == 42.5
+
+    request = struct.pack('>BHHB3H', WRITE_MULTIPLE, 3, 3, 6, 800, 20, 0)
+    assert server.process(request) == request[:5]
+    assert (engine.Kp, engine.Ki, engine.Kd) == (0.8, 0.02, 0.0)
+
+    # Command bits: stop the fill, start the drain
+    server.process(struct.pack('>BHH', WRITE_SINGLE, 0, 0b0110))
+    assert not engine.water_flow and engine.water_drain and engine.power_on
+    assert read(server, READ_HOLDING, 0, len(HOLDING_REGISTERS)) == [0b0110, 4250, 5000, 800, 20, 0]
+
+
+def test_read_write_multiple_writes_first(server):
+    request = struct.pack('>BHHHHB2H', READ_WRITE_MULTIPLE, 1, 2, 1, 2, 4, 3000, 7000)
+    response = server.process(request)
+    assert response == struct.pack('>BB2H', READ_WRITE_MULTIPLE, 4, 3000, 7000)
+    assert (server.engine.setpoint1, server.engine.setpoint2) == (30, 70)
+
+
+@pytest.mark.parametrize('request_pdu, code', [
+    (struct.pack('>BHH', 5, 0, 1), ILLEGAL_FUNCTION),
+    (struct.pack('>BHH', READ_INPUT, 7, 2), ILLEGAL_ADDRESS),
+    (struct.pack('>BHH', READ_HOLDING, 0, 0), ILLEGAL_VALUE),
+    (struct.pack('>BHH', READ_HOLDING, 0, 126), ILLEGAL_VALUE),
+    (struct.pack('>BHH', WRITE_SINGLE, 6, 1), ILLEGAL_ADDRESS),
+    (struct.pack('>BHHB2H', WRITE_MULTIPLE, 0, 2, 3, 1, 2), ILLEGAL_VALUE),
+    (struct.pack('>BH', READ_INPUT, 0), ILLEGAL_VALUE),
+])
+def test_exception_responses(server, request_pdu, code):
+    before = read(server, READ_HOLDING, 0, len(HOLDING_REGISTERS))
+    assert server.process(request_pdu) == bytes((request_pdu[0] | 0x80, code))
+    assert read(server, READ_HOLDING, 0, len(HOLDING_REGISTERS)) == before
+
+
+def test_tcp_round_trip(server):
+    server.port = 0
+    port = server.start()
+
+    async def session():
+        client = await ModbusClient(port=port).connect()
+        try:
+            inputs = await client.read_input_registers(0, len(INPUT_REGISTERS))
+            await client.write_registers(1, [6000, 6500])
+            holding = await client.read_holding_registers(1, 2)
+            with pytest.raises(ModbusError) as error:
+                await client.read_input_registers(0, len(INPUT_REGISTERS) + 1)
+            return inputs, holding, error.value.code
+        finally:
+            await client.close()
+
+    try:
+        inputs, holding, code = asyncio.run(session())
+    finally:
+        server.stop()
+    assert inputs[0] == round(server.engine.level1 * 100)
+    assert holding == [6000, 6500]
+    assert code == ILLEGAL_ADDRESS
+    assert server.requests == 4
@@ -0,0 +1,131 @@
+import asyncio
+
+import numpy as np
+
+from tank_engine import TankEngine
+from telemetry import DELTA, FIELDS, FLAGS, HEADER, KEYFRAME, FrameDecoder, FrameEncoder, Subscriber, \
+    TelemetryServer, sample, subscribe
+
+
+def engine_samples(steps=2000):
+    engine = TankEngine(record_history=False)
+    samples = [sample(engine)]
+    engine.start_water_flow()
+    for tick in range(steps):
+        if tick == 700:
+            engine.set_setpoints(70, 30)
+        if tick == 1500:
+            engine.start_water_drain()
+        engine.step()
+        samples.append(sample(engine))
+    return samples
+
+
+def as_message(state):
+    tick, values, flags = state
+    message = {'tick': tick, **dict(zip(FIELDS, values))}
+    message.update((name, bool(flags >> bit & 1)) for bit, name in enumerate(FLAGS))
+    return message
+
+
+def frames(data):
+    offset = 0
+    while offset < len(data):
+        length = int.from_bytes(data[offset:offset + 2], 'little')
+        yield data[offset:offset + length + 2]
+        offset += length + 2
+
+
+def test_round_trip_in_random_splits():
+    samples = engine_samples()
+    encoder = FrameEncoder()
+    data = b''.join(encoder.state(state) for state in samples)
+    data += encoder.event({'time': 1.0, 'status': 'test'})
+    decoder = FrameDecoder()
+    rng = np.random.default_rng(0)
+    cuts = np.sort(rng.integers(0, len(data), 300))
+    messages = []
+    for begin, end in zip(np.concatenate([[0], cuts]), np.concatenate([cuts, [len(data)]])):
+        messages += decoder.feed(data[begin:end])
+    assert messages[:-1] == [('state', as_message(state)) for state in samples]
+    assert messages[-1] == ('event', {'time': 1.0, 'status': 'test'})
+    assert decoder.lost == 0 and not decoder.buffer
+
+
+def test_deltas_only_carry_changed_fields():
+    encoder = FrameEncoder()
+    key = encoder.state((10, (0.0,) * len(FIELDS), 1))
+    delta = encoder.state((11, (0.1,) + (0.0,) * (len(FIELDS) - 1), 1))
+    assert HEADER.unpack_from(key)[1] == KEYFRAME
+    assert HEADER.unpack_from(delta)[1] == DELTA
+    assert len(delta) == HEADER.size + 4 + 8
+    # A tick jump that does not fit a delta starts over with a keyframe
+    assert HEADER.unpack_from(encoder.state((11 + 0x10000, (0.1,) + (0.0,) * (len(FIELDS) - 1), 1)))[1] == KEYFRAME
+
+
+def test_gap_waits_for_keyframe():
+    samples = engine_samples(50)
+    encoder = FrameEncoder()
+    stream = [encoder.state(state) for state in samples[:30]]
+    decoder = FrameDecoder()
+    received = decoder.feed(b''.join(stream[:10]) + b''.join(stream[11:]))
+    assert decoder.lost == 1
+    assert [message['tick'] for _, message in received] == [state[0] for state in samples[:10]]
+    # The resync keyframe reuses the current sequence number, so the frames after it are in order again
+    received = decoder.feed(encoder.keyframe() + b''.join(encoder.state(state) for state in samples[30:]))
+    assert [message for _, message in received] == [as_message(state) for state in samples[29:]]
+
+
+def test_full_queue_drops_then_resyncs():
+    server = TelemetryServer()
+    subscriber = Subscriber(writer=None, max_queue=1)
+    server.subscribers.add(subscriber)
+    samples = engine_samples(20)
+    server.pending.extend(samples[:5])
+    server.broadcast()
+    server.pending.extend(samples[5:10])
+    server.broadcast()
+    assert subscriber.resync and subscriber.dropped == 1
+
+    decoder = FrameDecoder()
+    received = decoder.feed(subscriber.queue.get_nowait())
+    server.pending.extend(samples[10:])
+    server.broadcast()
+    chunk = subscriber.queue.get_nowait()
+    assert HEADER.unpack_from(next(frames(chunk)))[1] == KEYFRAME
+    received += decoder.feed(chunk)
+    assert [message['tick'] for _, message in received] == [state[0] for state in samples[:5] + samples[9:]]
+    assert received[-1][1] == as_message(samples[-1])
+
+
+def test_server_streams_states_and_events():
+    engine = TankEngine(record_history=False)
+    server = TelemetryServer(port=0, interval=0.01)
+    server.attach(engine)
+    port = server.start()
+
+    async def read():
+        messages = []
+        stream = subscribe(port=port)
+        first = await asyncio.wait_for(stream.__anext__(), 5)
+        messages.append(first)
+        engine.start_water_flow()
+        for _ in range(400):
+            engine.step()
+        while not messages or messages[-1][0] != 'state' or messages[-1][1]['tick'] < engine.tick:
+            messages.append(await asyncio.wait_for(stream.__anext__(), 5))
+        await stream.aclose()
+        return messages
+
+    try:
+        messages = asyncio.run(read())
+    finally:
+        server.stop()
+        server.detach(engine)
+    states = [message for kind, message in messages if kind == 'state']
+    events = [message for kind, message in messages if kind == 'event']
+    assert states[-1]['level1'] == engine.level1 and states[-1]['water_flow']
+    # Every tick arrives in order; commands between steps publish the same tick again with the new flags
+    ticks = [state['tick'] for state in states]
+    assert ticks == sorted(ticks) and set(ticks) == set(range(ticks[0], engine.tick + 1))
+    assert {'status': "System Status: Water Flow Started", 'time': 0} in events
@@ -0,0 +1,110 @@
+import numpy as np
+import pytest
+
+from thresholds import ThresholdRegistry
+
+
+class ReferenceThreshold:
+    # One threshold on its own: active at level >= threshold, inactive again below threshold - hysteresis
+    def __init__(self, tank, threshold, hysteresis):
+        self.tank = tank
+        self.threshold = threshold
+        self.hysteresis = hysteresis
+        self.active = False
+
+    def update(self, level):
+        active = level >= self.threshold - self.hysteresis if self.active else level >= self.threshold
+        changed = active != self.active
+        self.active = active
+        return changed
+
+
+def active_set(registry):
+    return sorted(zip(registry.tanks[registry.active].tolist(), registry.thresholds[registry.active].tolist()))
+
+
+def test_hysteresis_overlapping_a_lower_threshold():
+    registry = ThresholdRegistry(1)
+    registry.add(0, 38, falling=True)
+    registry.add(0, 40, hysteresis=5, falling=True)
+    registry.reset([0])
+    registry.evaluate([45])
+    assert registry.active_thresholds('level') == [38, 40]
+    events = registry.evaluate([37])
+    assert [(event.threshold, event.rising) for event in events] == [(38, False)]
+    assert registry.active_thresholds('level') == [40]
+    assert registry.evaluate([36]) == []
+    events = registry.evaluate([34.9])
+    assert [(event.threshold, event.rising) for event in events] == [(40, False)]
+
+
+def test_events_are_ordered_by_tank_and_crossing_direction():
+    registry = ThresholdRegistry(2)
+    for tank in range(2):
+        for level in (10, 20, 30):
+            registry.add(tank, level, falling=True)
+    registry.reset([25, 0])
+    events = registry.evaluate([5, 35], time=1.5)
+    assert [(event.tank, event.threshold, event.rising) for event in events] == [
+        (0, 20, False), (0, 10, False), (1, 10, True), (1, 20, True), (1, 30, True)]
+    assert all(event.time == 1.5 for event in events)
+
+
+def test_subscribers_only_get_their_kinds():
+    registry = ThresholdRegistry(1)
+    registry.add(0, 50, kind='log')
+    registry.add(0, 90, kind='alarm')
+    received = []
+    registry.subscribe(received.extend, kinds=['alarm'])
+    registry.reset([0])
+    registry.evaluate([95])
+    assert [event.kind for event in received] == ['alarm']
+    registry.unsubscribe(received.extend)
+    registry.evaluate([0])
+    registry.evaluate([95])
+    assert len(received) == 1
+
+
+def test_empty_registry():
+    registry = ThresholdRegistry(2)
+    registry.reset([10, 20])
+    registry.restore([0, 0])
+    assert registry.evaluate([50, 60]) == []
+    assert registry.highest_active('alarm') is None
+
+
+def test_restore_keeps_band():
+    registry = ThresholdRegistry(1)
+    for level in (90, 95, 100):
+        registry.add(0, level, kind='alarm', falling=True)
+    registry.compile()
+    registry.restore([2])
+    assert registry.highest_active('alarm') == 95
+    assert registry.evaluate([96]) == []
+    assert [event.threshold for event in registry.evaluate([89])] == [95, 90]
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_matches_per_threshold_reference(seed):
+    rng = np.random.default_rng(seed)
+    n_tanks = 3
+    registry = ThresholdRegistry(n_tanks)
+    reference = []
+    for tank in range(n_tanks):
+        for _ in range(rng.integers(0, 6)):
+            threshold = float(rng.integers(0, 100))
+            hysteresis = float(rng.choice([0, 0, 2, 5, 15]))
+            registry.add(tank, threshold, hysteresis=hysteresis, falling=True)
+            reference.append(ReferenceThreshold(tank, threshold, hysteresis))
+
+    levels = rng.uniform(0, 100, n_tanks)
+    registry.reset(levels)
+    for entry in reference:
+        entry.active = levels[entry.tank] >= entry.threshold
+    for _ in range(500):
+        levels = np.clip(levels + rng.normal(0, 4, n_tanks), 0, 100)
+        events = registry.evaluate(levels)
+        expected = sorted((entry.tank, entry.threshold, entry.active) for entry in reference
+                          if entry.update(levels[entry.tank]))
+        assert sorted((event.tank, event.threshold, event.rising) for event in events) == expected
+        assert active_set(registry) == sorted((entry.tank, entry.threshold) for entry in reference if entry.active)
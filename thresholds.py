@@ -0,0 +1,122 @@
+from collections import namedtuple
+
+import numpy as np
+
+ThresholdEvent = namedtuple('ThresholdEvent', ['time', 'tank', 'level', 'threshold', 'name', 'kind', 'rising'])
+
+
+# Registry of per-tank thresholds evaluated in one pass. Every threshold keeps its own active state: it turns
+# active at level >= threshold and, with hysteresis h, only turns inactive again below threshold - h, so its
+# band may overlap other thresholds of the same tank. For every tank the registry keeps the range of levels
+# that cannot change any of its thresholds; evaluate() returns straight away while all tanks stay inside their
+# ranges and otherwise re-checks the thresholds, emitting an event for every one that changed since the last call.
+class ThresholdRegistry:
+    def __init__(self, n_tanks):
+        self.n_tanks = n_tanks
+        self.entries = []
+        self.subscribers = []
+        self.compiled = False
+        self.band = np.zeros(n_tanks, dtype=np.int64)
+
+    def add(self, tank, threshold, name=None, kind='level', hysteresis=0.0, rising=True, falling=False):
+        self.entries.append((tank, float(threshold), name or f"{threshold:g}%", kind, float(hysteresis), rising, falling))
+        self.compiled = False
+
+    def subscribe(self, callback, kinds=None):
+        self.subscribers.append((callback, None if kinds is None else set(kinds)))
+
+    def unsubscribe(self, callback):
+        self.subscribers = [(subscriber, kinds) for subscriber, kinds in self.subscribers if subscriber != callback]
+
+    def compile(self):
+        entries = sorted(self.entries, key=lambda entry: (entry[0], entry[1]))
+        self.sorted_entries = entries
+        self.tanks = np.array([entry[0] for entry in entries], dtype=np.int64)
+        self.thresholds = np.array([entry[1] for entry in entries], dtype=float)
+        self.lower = self.thresholds - np.array([entry[4] for entry in entries], dtype=float)
+        self.kinds = np.array([entry[3] for entry in entries], dtype=object)
+        self.tank_start = np.searchsorted(self.tanks, np.arange(self.n_tanks))
+        counts = np.diff(np.append(self.tank_start, len(entries)))
+        self.occupied = counts > 0
+        self.kind_masks = {kind: self.kinds == kind for kind in set(self.kinds.tolist())}
+        self.active = np.zeros(len(entries), dtype=bool)
+        self.compiled = True
+
+    def levels(self, tank):
+        if not self.compiled:
+            self.compile()
+        return np.unique(self.thresholds[self.tanks == tank])
+
+    def reset(self, levels):
+        # Takes the current levels as the baseline without emitting events
+        if not self.compiled:
+            self.compile()
+        levels = np.asarray(levels, dtype=float)
+        self.active = levels[self.tanks] >= self.thresholds
+        self.update_bounds()
+
+    def restore(self, band):
+        # Sets each tank's band (its number of active thresholds) directly, e.g. from a checkpoint, so hysteresis
+        # state survives a restore. The lowest thresholds of the tank are made active, which is exact unless a
+        # hysteresis band overlaps another threshold of the same tank.
+        if not self.compiled:
+            self.compile()
+        band = np.asarray(band, dtype=np.int64)
+        self.active = np.arange(len(self.thresholds)) < self.tank_start[self.tanks] + band[self.tanks]
+        self.update_bounds()
+
+    def update_bounds(self):
+        # Levels inside [lower_bound, upper_bound) cannot change any threshold of the tank: that is below its
+        # lowest inactive threshold and at or above the highest falling bound of its active ones. This lets
+        # evaluate() skip the per-threshold check on the vast majority of calls.
+        self.band = np.bincount(self.tanks, weights=self.active, minlength=self.n_tanks).astype(np.int64)
+        self.upper_bound = np.full(self.n_tanks, np.inf)
+        self.lower_bound = np.full(self.n_tanks, -np.inf)
+        if len(self.thresholds):
+            starts = self.tank_start[self.occupied]
+            self.upper_bound[self.occupied] = np.minimum.reduceat(np.where(self.active, np.inf, self.thresholds), starts)
+            self.lower_bound[self.occupied] = np.maximum.reduceat(np.where(self.active, self.lower, -np.inf), starts)
+
+    def evaluate(self, levels, time=0.0):
+        if not self.compiled:
+            self.compile()
+            self.reset(np.zeros(self.n_tanks))
+        levels = np.asarray(levels, dtype=float)
+        if not ((levels >= self.upper_bound) | (levels < self.lower_bound)).any():
+            return []
+        entry_levels = levels[self.tanks]
+        active = np.where(self.active, entry_levels >= self.lower, entry_levels >= self.thresholds)
+        changed = np.flatnonzero(active != self.active)
+        if not len(changed):
+            return []
+
+        # Per tank, thresholds crossed falling are reported from the top down, then those crossed rising from
+        # the bottom up
+        order = np.lexsort((np.where(active[changed], changed, -changed), active[changed], self.tanks[changed]))
+        events = []
+        for index in changed[order].tolist():
+            tank, threshold, name, kind, _, on_rising, on_falling = self.sorted_entries[index]
+            rising = bool(active[index])
+            if (on_rising if rising else on_falling):
+                events.append(ThresholdEvent(time, tank, float(levels[tank]), threshold, name, kind, rising))
+        self.active = active
+        self.update_bounds()
+
+        for callback, kinds in list(self.subscribers):
+            selected = events if kinds is None else [event for event in events if event.kind in kinds]
+            if selected:
+                callback(selected)
+        return events
+
+    def highest_active(self, kind):
+        # Highest threshold of this kind that any tank is currently at or above, or None
+        if kind not in self.kind_masks:
+            return None
+        mask = self.active & self.kind_masks[kind]
+        return float(self.thresholds[mask].max()) if mask.any() else None
+
+    def active_thresholds(self, kind):
+        # Every threshold of this kind that some tank is currently at or above, in ascending order
+        if kind not in self.kind_masks:
+            return []
+        return sorted(set(self.thresholds[self.active & self.kind_masks[kind]].tolist()))